@@ -1,4 +1,9 @@
-from .thought_bubble_node import ThoughtBubbleNode
+from .thought_bubble_node import ThoughtBubbleNode, ThoughtBubbleBatchNode
+from .wildcards import release_wildcard
+from .conditioning import CONDITIONING_CACHE, TOKEN_CACHE
+from .loras import LORA_CACHE
+from .commands import REGISTRY
+from .name_index import get_name_index
 from aiohttp import web
 import server
 import folder_paths
@@ -36,7 +41,7 @@ def is_path_safe(base_dir, filepath):
 @server.PromptServer.instance.routes.get("/loras")
 async def get_loras(request):
     try:
-        lora_names = folder_paths.get_filename_list("loras")
+        lora_names = get_name_index("loras").names
         return web.json_response(lora_names)
     except Exception as e:
         return web.json_response({"error": str(e)}, status=500)
@@ -45,11 +50,27 @@ async def get_loras(request):
 @server.PromptServer.instance.routes.get("/embeddings")
 async def get_embeddings(request):
     try:
-        embedding_names = folder_paths.get_filename_list("embeddings")
+        embedding_names = get_name_index("embeddings", fold_case=True).names
         return web.json_response(embedding_names)
     except Exception as e:
         return web.json_response({"error": str(e)}, status=500)
 
+@server.PromptServer.instance.routes.get("/thoughtbubble/cache_stats")
+async def get_cache_stats(request):
+    return web.json_response({
+        "loras": LORA_CACHE.stats(),
+        "conditioning": CONDITIONING_CACHE.stats(),
+        "tokens": TOKEN_CACHE.stats(),
+    })
+
+@server.PromptServer.instance.routes.get("/thoughtbubble/iterator_commands")
+async def get_iterator_commands(request):
+    # Every spelling of a command that reads the run counter, built-in or
+    # registered by another extension. The frontend leaves the counter out of
+    # the prompt when none of them appears in the canvas.
+    aliases = [alias for spec in REGISTRY.specs() if spec.reads_iterator for alias in spec.aliases]
+    return web.json_response(sorted(aliases))
+
 
 # --- Text File Endpoints ---
 @server.PromptServer.instance.routes.get("/thoughtbubble/textfiles")
@@ -136,6 +157,8 @@ async def save_wildcard_file(request):
         if not is_path_safe(wildcards_directory, filepath):
             return web.json_response({"error": "Invalid file path detected."}, status=403)
 
+        # Wildcards are memory-mapped while in use; unmap before rewriting.
+        release_wildcard(wildcards_directory, secure_filename)
         with open(filepath, 'w', encoding='utf-8') as f:
             f.write(content)
         return web.json_response({"success": True, "message": f"Saved to {secure_filename}"})
@@ -251,7 +274,13 @@ async def get_default_theme(request):
         return web.json_response(json.load(f))
 
 # --- Node Mappings ---
-NODE_CLASS_MAPPINGS = { "ThoughtBubbleNode": ThoughtBubbleNode }
-NODE_DISPLAY_NAME_MAPPINGS = { "ThoughtBubbleNode": "Thought Bubble" }
+NODE_CLASS_MAPPINGS = {
+    "ThoughtBubbleNode": ThoughtBubbleNode,
+    "ThoughtBubbleBatchNode": ThoughtBubbleBatchNode,
+}
+NODE_DISPLAY_NAME_MAPPINGS = {
+    "ThoughtBubbleNode": "Thought Bubble",
+    "ThoughtBubbleBatchNode": "Thought Bubble (Batch)",
+}
 WEB_DIRECTORY = "./js"
 __all__ = ['NODE_CLASS_MAPPINGS', 'NODE_DISPLAY_NAME_MAPPINGS']
\ No newline at end of file
@@ -0,0 +1,35 @@
+# filename: thoughtbubble/benchmarks/_common.py
+
+# Shared helpers for the benchmark scripts. The package __init__ registers
+# server routes, so the benchmarks import the modules they need through a bare
+# package shim instead. ComfyUI must be importable (run the scripts from the
+# ComfyUI root, or put it on PYTHONPATH).
+
+import importlib
+import os
+import sys
+import time
+import types
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE_NAME = "thoughtbubble"
+
+
+def load(module_name):
+    if PACKAGE_NAME not in sys.modules:
+        package = types.ModuleType(PACKAGE_NAME)
+        package.__path__ = [PACKAGE_DIR]
+        sys.modules[PACKAGE_NAME] = package
+    return importlib.import_module(f"{PACKAGE_NAME}.{module_name}")
+
+
+def best_of(func, repeat=5):
+    """Returns the fastest wall time of `repeat` calls, in seconds."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
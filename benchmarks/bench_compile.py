@@ -0,0 +1,66 @@
+# filename: thoughtbubble/benchmarks/bench_compile.py
+
+# Compares the tree-walking interpreter (Node.execute) with the compiled
+# closures (compile_tree) on batch and iterator-sweep workloads.
+# Usage: python benchmarks/bench_compile.py
+# Both columns evaluate the same trees; only the execution strategy differs.
+# Boxes reached through v() always run compiled, so they count in both.
+
+import random
+
+from _common import best_of, load
+
+parser_module = load("parser")
+
+BOX_MAP = {
+    "subject": "w(cat|dog:2|fox), i(sitting|running|sleeping)",
+    "style": "w(oil painting|watercolor|v(medium)), ?(cat|fluffy fur)",
+    "medium": "charcoal, h(note to self)",
+}
+
+SNIPPET = (
+    "v(subject), v(style), i((red|blue|green)|(day|night)), "
+    "?(night|moonlit|sunny), -(blurry, !sharp), r(1|5) "
+)
+
+WORKLOADS = (
+    ("batch (seeds)", [(seed, 0) for seed in range(200)]),
+    ("iterator sweep", [(0, iterator) for iterator in range(200)]),
+)
+
+
+def run_tree(parser, root, pairs):
+    for seed, iterator in pairs:
+        parser._reset()
+        parser.rng = random.Random(seed)
+        parser.iterator = iterator
+        root.execute(parser, context="")
+
+
+def run_program(parser, program, pairs):
+    for seed, iterator in pairs:
+        parser._reset()
+        parser.rng = random.Random(seed)
+        parser.iterator = iterator
+        program.execute(parser, context="")
+
+
+def main():
+    print(f"{'workload':>16} {'repeat':>7} {'tree ms':>10} {'compiled ms':>12} {'speedup':>8}")
+    for name, pairs in WORKLOADS:
+        for repeat in (1, 10, 50):
+            text = SNIPPET * repeat
+            parser = parser_module.CanvasParser(BOX_MAP, {}, "", random.Random(0))
+            root = parser._get_tree(text)
+            program = parser._get_program(text)
+
+            tree_time = best_of(lambda: run_tree(parser, root, pairs), repeat=3)
+            program_time = best_of(lambda: run_program(parser, program, pairs), repeat=3)
+            print(
+                f"{name:>16} {repeat:>7} {tree_time * 1000:>10.2f} "
+                f"{program_time * 1000:>12.2f} {tree_time / program_time:>7.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
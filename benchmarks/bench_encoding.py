@@ -0,0 +1,133 @@
+# filename: thoughtbubble/benchmarks/bench_encoding.py
+
+# Compares batched prompt encoding (conditioning.encode_texts) with one
+# encode_from_tokens call per prompt, and checks that both give the same
+# conditioning.
+# Usage: python benchmarks/bench_encoding.py
+# Uses a CPU stand-in for ComfyUI's CLIP with the same interface: 77-token
+# sections encoded independently, concatenated along the token axis, and the
+# pooled output of the first section only (a bare cond unless it is asked for).
+
+import random
+
+import torch
+
+from _common import best_of, load
+
+conditioning = load("conditioning")
+
+SECTION = 77
+WIDTH = 64
+WORDS = ["cat", "dog", "red", "blue", "night", "forest", "oil", "painting"]
+
+
+class StubClip:
+    def __init__(self, pooled_per_section=False, max_call_sections=None):
+        generator = torch.Generator().manual_seed(0)
+        self.embeddings = torch.randn(1000, WIDTH, generator=generator)
+        self.layers = [
+            torch.randn(WIDTH, WIDTH, generator=generator) / WIDTH**0.5
+            for _ in range(4)
+        ]
+        self.pooled_per_section = pooled_per_section
+        # Batches larger than this fail, like a forward pass running out of
+        # memory.
+        self.max_call_sections = max_call_sections
+        self.calls = 0
+
+    def tokenize(self, text):
+        ids = [sum(map(ord, word)) % 1000 for word in text.split()]
+        sections = []
+        for start in range(0, max(len(ids), 1), SECTION - 2):
+            section = [(1, 1.0)]
+            section += [(i, 1.0) for i in ids[start : start + SECTION - 2]]
+            section += [(2, 1.0)] * (SECTION - len(section))
+            sections.append(section)
+        return {"l": sections}
+
+    def encode_from_tokens(self, tokens, return_pooled=False):
+        self.calls += 1
+        sections = tokens["l"]
+        if self.max_call_sections and len(sections) > self.max_call_sections:
+            raise RuntimeError("out of memory")
+        hidden = self.embeddings[
+            torch.tensor([[token for token, _ in section] for section in sections])
+        ]
+        for layer in self.layers:
+            hidden = torch.tanh(hidden @ layer + hidden.mean(dim=1, keepdim=True))
+        cond = hidden.reshape(1, -1, WIDTH)
+        if not return_pooled:
+            return cond
+        pooled = hidden[:, -1]
+        return cond, pooled if self.pooled_per_section else pooled[:1]
+
+
+def prompts(count, seed=0):
+    rng = random.Random(seed)
+    # Mostly one section, some two or three, like negative and area prompts
+    # next to a long positive one.
+    return [
+        " ".join(rng.choice(WORDS) for _ in range(rng.choice((8, 8, 20, 100, 180))))
+        for _ in range(count)
+    ]
+
+
+def encode_each(clip, texts):
+    return {
+        text: [[cond, {"pooled_output": pooled}]]
+        for text in dict.fromkeys(texts)
+        for cond, pooled in [clip.encode_from_tokens(clip.tokenize(text), True)]
+    }
+
+
+def same(expected, actual):
+    return expected.keys() == actual.keys() and all(
+        torch.allclose(expected[text][0][0], actual[text][0][0], atol=1e-5)
+        and torch.allclose(
+            expected[text][0][1]["pooled_output"],
+            actual[text][0][1]["pooled_output"],
+            atol=1e-5,
+        )
+        for text in expected
+    )
+
+
+def check(name, clip, texts, max_batch_sections=None):
+    conditioning._POOLED_PER_SECTION.clear()
+    expected = encode_each(StubClip(), texts)
+    results = [
+        conditioning.encode_texts(clip, texts, max_batch_sections) for _ in range(2)
+    ]
+    matches = all(same(expected, result) for result in results)
+    print(f"{name:>32}: {'same as one by one' if matches else 'MISMATCH'}")
+    return matches
+
+
+def main():
+    texts = prompts(12)
+    # The second call of each check runs with the pooled-output probe settled.
+    checks = [
+        check("first-section pooled (ComfyUI)", StubClip(), texts),
+        check("per-section pooled", StubClip(pooled_per_section=True), texts),
+        check("batches of at most 3 sections", StubClip(), texts, 3),
+        check("batch call fails", StubClip(max_call_sections=3), texts),
+        check("mixed order and duplicates", StubClip(), texts[::-1] + texts[:4]),
+    ]
+    print(f"all checks passed: {all(checks)}")
+
+    print(f"{'prompts':>8} {'one by one ms':>14} {'batched ms':>11} {'calls':>6}")
+    for count in (2, 4, 8, 16):
+        texts = prompts(count, seed=count)
+        clip = StubClip()
+        each_time = best_of(lambda: encode_each(clip, texts), repeat=3)
+        batch_time = best_of(lambda: conditioning.encode_texts(clip, texts), repeat=3)
+        clip.calls = 0
+        conditioning.encode_texts(clip, texts)
+        print(
+            f"{count:>8} {each_time * 1000:>14.2f} {batch_time * 1000:>11.2f} "
+            f"{clip.calls:>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# filename: thoughtbubble/benchmarks/bench_lora_patching.py
+
+# Compares incremental LoRA patching with re-patching from the base model.
+# Usage: python benchmarks/bench_lora_patching.py
+# Uses small stand-ins for ComfyUI's ModelPatcher and CLIP that keep patches
+# the same way (key -> list of patch tuples, copied on clone). Like ComfyUI,
+# add_patches() rebuilds the model's state dict on every call and loading a
+# LoRA's patches walks all of its keys; file reading is not included.
+
+import random
+import uuid
+
+from _common import best_of, load
+
+loras_module = load("loras")
+
+KEYS_PER_LORA = 2000
+LORA_COUNT = 6
+MODEL_KEYS = [f"layer{k}" for k in range(KEYS_PER_LORA * 2)]
+RUNS = 50
+
+counts = {"patch loads": 0, "add_patches": 0}
+
+
+class StubPatcher:
+    def __init__(self):
+        self.patches = {}
+        self.patches_uuid = uuid.uuid4()
+
+    def clone(self):
+        clone = StubPatcher()
+        clone.patches = {key: patches[:] for key, patches in self.patches.items()}
+        clone.patches_uuid = self.patches_uuid
+        return clone
+
+    def add_patches(self, patches, strength_patch=1.0, strength_model=1.0):
+        counts["add_patches"] += 1
+        model_sd = {key: None for key in MODEL_KEYS}
+        added = []
+        for key, value in patches.items():
+            if key in model_sd:
+                added.append(key)
+                self.patches.setdefault(key, []).append(
+                    (strength_patch, value, strength_model, None, None)
+                )
+        self.patches_uuid = uuid.uuid4()
+        return added
+
+
+class StubClip:
+    def __init__(self, patcher=None):
+        self.patcher = patcher or StubPatcher()
+
+    def clone(self):
+        return StubClip(self.patcher.clone())
+
+    def add_patches(self, patches, strength_patch=1.0, strength_model=1.0):
+        return self.patcher.add_patches(patches, strength_patch, strength_model)
+
+
+# Consecutive LoRAs overlap by half their keys, like real LoRAs that target
+# the same attention layers.
+LORA_KEYS = {
+    f"lora{i}": [
+        MODEL_KEYS[(i * KEYS_PER_LORA // 2 + k) % len(MODEL_KEYS)]
+        for k in range(KEYS_PER_LORA)
+    ]
+    for i in range(LORA_COUNT)
+}
+
+
+class StubStack(loras_module.LoraPatchStack):
+    def _load_patches(self, model, clip, path):
+        counts["patch loads"] += 1
+        return {key: ("lora", path, key) for key in LORA_KEYS[path]}
+
+
+class RebuildStack(StubStack):
+    def _plan(self, wanted):
+        return None
+
+
+def configs():
+    rng = random.Random(0)
+    strengths = [1.0] * LORA_COUNT
+    for _ in range(RUNS):
+        strengths[rng.randrange(LORA_COUNT)] = round(rng.uniform(0.1, 1.5), 2)
+        yield [(f"lora{i}", s, s) for i, s in enumerate(strengths)]
+
+
+def run(stack_type):
+    loras_module.file_version = lambda path: (0, 0)
+    for name in counts:
+        counts[name] = 0
+    model, clip = StubPatcher(), StubClip()
+    stack = stack_type()
+    results = [stack.apply(model, clip, config) for config in configs()]
+    return stack, results
+
+
+def snapshot(model, clip):
+    return [
+        {key: [p[:2] for p in patches] for key, patches in patcher.patches.items()}
+        for patcher in (model, clip.patcher)
+    ]
+
+
+def main():
+    incremental, incremental_results = run(StubStack)
+    rebuild, rebuild_results = run(RebuildStack)
+    same = all(
+        snapshot(*a) == snapshot(*b)
+        for a, b in zip(incremental_results, rebuild_results)
+    )
+    print(
+        f"{LORA_COUNT} LoRAs x {KEYS_PER_LORA} keys, {RUNS} runs, "
+        "one strength changed per run"
+    )
+    print(f"identical patches: {same}")
+    for name, stack_type in (("rebuild", RebuildStack), ("incremental", StubStack)):
+        elapsed = best_of(lambda: run(stack_type), repeat=3)
+        stack, _ = run(stack_type)
+        print(
+            f"{name:>12}: {elapsed * 1000 / RUNS:8.2f} ms/run  "
+            f"patch loads={counts['patch loads']} "
+            f"add_patches={counts['add_patches']} "
+            f"rebuilds={stack.counters['rebuilds']} "
+            f"reweighted={stack.counters['reweighted']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
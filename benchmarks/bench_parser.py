@@ -0,0 +1,38 @@
+# filename: thoughtbubble/benchmarks/bench_parser.py
+
+# Measures tokenizing + tree building for growing canvases.
+# Usage: python benchmarks/bench_parser.py
+# The time per token should stay flat as the input grows.
+
+import random
+
+from _common import best_of, load
+
+parser_module = load("parser")
+
+SNIPPET = "w(red|blue:2|i((a|b)|(c|d))), ?(cat|v(box)|-(ugly)), lora(detail:0.7) "
+
+
+def build_canvas(repeat):
+    return SNIPPET * repeat
+
+
+def main():
+    parser = parser_module.CanvasParser({}, {}, "", random.Random(0))
+    print(f"{'chars':>10} {'tokens':>10} {'total ms':>10} {'ns/token':>10}")
+    for repeat in (10, 100, 1000, 5000, 20000):
+        text = build_canvas(repeat)
+        token_count = len(parser._tokenize(text))
+
+        def run():
+            parser._build_tree(parser._tokenize(text), 0, terminators=())
+
+        elapsed = best_of(run, repeat=3)
+        print(
+            f"{len(text):>10} {token_count:>10} {elapsed * 1000:>10.2f} "
+            f"{elapsed * 1e9 / token_count:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,6 @@
 # filename: thoughtbubble/commands/__init__.py
 
-# This file makes the 'commands' folder a Python package and
-# imports all the command modules to make them accessible from the outside.
+# This file makes the 'commands' folder a Python package. The command modules
+# are listed in registry.py and imported the first time a command is used.
 
-from . import command_area
-from . import command_embed
-from . import command_eq
-from . import command_h
-from . import command_i
-from . import command_if
-from . import command_lora
-from . import command_multi_if
-from . import command_neg
-from . import command_o
-from . import command_r
-from . import command_v
-from . import command_w
-from . import command_t
\ No newline at end of file
+from .registry import REGISTRY, CommandSpec, register_command
@@ -1,6 +1,6 @@
 # filename: thoughtbubble/commands/command_embed.py
-import folder_paths
 import os
+from ..name_index import get_name_index
 
 
 def execute(parser, args, **kwargs):
@@ -40,29 +40,15 @@ def execute(parser, args, **kwargs):
     if not hasattr(parser, "embedding_cache"):
         parser.embedding_cache = {}
 
-    # Initialize Embedding List if missing
-    if not hasattr(parser, "_available_embeddings"):
-        try:
-            parser._available_embeddings = folder_paths.get_filename_list("embeddings")
-        except Exception:
-            parser._available_embeddings = []
-
-    # Find the matching filename
-    found_filename = None
+    # Shared, case-insensitive index of the embeddings folder
+    embeddings = get_name_index("embeddings", fold_case=True)
 
     # 1. Try Exact Match (Case Insensitive)
-    lower_target = embedding_name.lower()
-    for f in parser._available_embeddings:
-        if f.lower() == lower_target:
-            found_filename = f
-            break
+    found_filename = embeddings.find_exact(embedding_name)
 
     # 2. Try Partial Match (Starts With)
     if not found_filename:
-        for f in parser._available_embeddings:
-            if f.lower().startswith(lower_target):
-                found_filename = f
-                break
+        found_filename = embeddings.find_prefix(embedding_name)
 
     # Construct the final string for ComfyUI
     if found_filename:
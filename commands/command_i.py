@@ -1,7 +1,16 @@
 # filename: thoughtbubble/commands/command_i.py
 
 import itertools
-from .utils import parse_weighted_option, fetch_list_source
+import re
+from bisect import bisect_right
+from .utils import parse_weighted_option, fetch_count_table
+
+# Lazy mode stands nested commands in for private-use characters while the
+# arguments are expanded, and only runs the ones that end up selected. Text
+# that already holds characters from that range gets them escaped the same
+# way, each standing in for itself.
+_PLACEHOLDER_BASE = 0xF0000
+_PLACEHOLDER = re.compile("[\U000F0000-\U000FFFFD]")
 
 
 def _split_by_pipe(text):
@@ -78,16 +87,105 @@ def _expand_options(text):
     return results
 
 
+class _Dimension:
+    """
+    Lazy list of options for one i() argument.
+
+    Each expanded option becomes a block of `count` entries instead of being
+    replicated: a literal repeated `weight` times, or a list source whose
+    lines carry their own repetition counts, repeated `weight` times as a
+    whole. Entry N is found by bisecting the cumulative block counts.
+    """
+
+    def __init__(self, escape=None):
+        self.blocks = []
+        self.cum_counts = []
+        self.total = 0
+        # Lazy mode: escapes placeholder characters in list source lines.
+        self.escape = escape
+
+    def add(self, count, block):
+        self.total += count
+        self.blocks.append(block)
+        self.cum_counts.append(self.total)
+
+    def __len__(self):
+        return self.total
+
+    def __getitem__(self, position):
+        block_index = bisect_right(self.cum_counts, position)
+        offset = position - (self.cum_counts[block_index - 1] if block_index else 0)
+        block = self.blocks[block_index]
+        if len(block) == 1:
+            return block[0]
+        lines, table, prefix, suffix = block
+        line = parse_weighted_option(lines[table.locate(offset % table.total)])[0]
+        if self.escape is not None:
+            line = self.escape(line)
+        return f"{prefix}{line.strip()}{suffix}"
+
+
+def _build_dimension(parser, content, nested_commands=None):
+    """`nested_commands` is the placeholder list in lazy mode, else None."""
+    escape = None
+    if nested_commands is not None:
+        escape = lambda text: _escape(text, nested_commands)
+    dimension = _Dimension(escape)
+    for opt in _expand_options(content):
+        text_part, weight_float = parse_weighted_option(opt)
+        weight = int(weight_float)  # Iterator needs int count
+        if weight <= 0:
+            continue
+
+        key_text = text_part
+        if nested_commands is not None:
+            key_text = _unescape(text_part, nested_commands)
+            if key_text is None:
+                # Lazy mode: an option holding a nested command is a literal.
+                dimension.add(weight, (text_part,))
+                continue
+
+        clean_opt = key_text.strip()
+
+        # Helper to preserve whitespace surrounding the key
+        prefix = ""
+        suffix = ""
+        if clean_opt and clean_opt in key_text:
+            idx = key_text.find(clean_opt)
+            prefix = key_text[:idx]
+            suffix = key_text[idx + len(clean_opt) :]
+
+        # Unified Source Check (Wildcards, Boxes, Vars)
+        source_lines, table = fetch_count_table(parser, clean_opt)
+
+        if source_lines is not None:
+            # Lines repeat by their own weights; the whole list repeats by the
+            # outer weight.
+            if table is not None and table.total > 0:
+                dimension.add(
+                    table.total * weight, (source_lines, table, prefix, suffix)
+                )
+        else:
+            # Literal Text
+            dimension.add(weight, (text_part,))
+    return dimension
+
+
 def execute(parser, args, **kwargs):
     if not args:
         return ""
     context = kwargs.get("context", "")
 
-    # 1. Execute all args
-    resolved_args = []
-    for arg in args:
-        content = arg.execute(parser, context=context)
-        resolved_args.append(content)
+    # 1. Execute all args (lazy mode: literal text only, see _run_placeholders)
+    nested_commands = None
+    if parser.lazy_branches:
+        nested_commands = []
+        resolved_args = [_placeholder_text(arg, nested_commands) for arg in args]
+    else:
+        resolved_args = []
+        for arg in args:
+            content = arg.execute(parser, context=context)
+            resolved_args.append(content)
 
     # 2. Determine Mode
     is_dimensional_mode = False
@@ -101,58 +199,90 @@ def execute(parser, args, **kwargs):
         if all_wrapped:
             is_dimensional_mode = True
 
-    # 3. Process Arguments
-    dimensions = []
-    for content in resolved_args:
-        expanded_list = _expand_options(content)
-        dim_options = []
-
-        for opt in expanded_list:
-            text_part, weight_float = parse_weighted_option(opt)
-            weight = int(weight_float)  # Iterator needs int count
-
-            clean_opt = text_part.strip()
-
-            # Helper to preserve whitespace surrounding the key
-            prefix = ""
-            suffix = ""
-            if clean_opt and clean_opt in text_part:
-                idx = text_part.find(clean_opt)
-                prefix = text_part[:idx]
-                suffix = text_part[idx + len(clean_opt) :]
-
-            items_to_add = []
-
-            # Unified Source Check (Wildcards, Boxes, Vars)
-            source_lines = fetch_list_source(parser, clean_opt)
-
-            if source_lines is not None:
-                # Process lines for weights too
-                for line in source_lines:
-                    l_text, l_w = parse_weighted_option(line)
-                    l_count = int(l_w)
-                    if l_count > 0:
-                        items_to_add.extend(
-                            [f"{prefix}{l_text.strip()}{suffix}"] * l_count
-                        )
-            else:
-                # Literal Text
-                items_to_add = [text_part]
+    # 3. Process Arguments (sizes only; entries are decoded on demand)
+    dimensions = [
+        _build_dimension(parser, content, nested_commands)
+        for content in resolved_args
+    ]
+    result = _select(parser, dimensions, is_dimensional_mode)
+    if nested_commands:
+        result = _run_placeholders(parser, result, nested_commands, context)
+    return result
+
+
+def _placeholder_text(arg, nested_commands):
+    parts = []
+    for child in arg.children:
+        text = getattr(child, "text", None)
+        if text is None:
+            parts.append(_placeholder(child, nested_commands))
+        else:
+            parts.append(_escape(text, nested_commands))
+    return "".join(parts)
+
+
+def _placeholder(item, nested_commands):
+    nested_commands.append(item)
+    return chr(_PLACEHOLDER_BASE + len(nested_commands) - 1)
+
+
+def _escape(text, nested_commands):
+    """Replaces placeholder-range characters with placeholders for themselves."""
+    if not _PLACEHOLDER.search(text):
+        return text
+    return _PLACEHOLDER.sub(
+        lambda match: _placeholder(match.group(), nested_commands), text
+    )
+
+
+def _unescape(text, nested_commands):
+    """`text` with escaped characters restored, or None if it holds a command."""
+    if not _PLACEHOLDER.search(text):
+        return text
+    items = [
+        nested_commands[ord(char) - _PLACEHOLDER_BASE]
+        for char in _PLACEHOLDER.findall(text)
+    ]
+    if not all(isinstance(item, str) for item in items):
+        return None
+    return _PLACEHOLDER.sub(
+        lambda match: nested_commands[ord(match.group()) - _PLACEHOLDER_BASE], text
+    )
 
-            # Apply the outer weight (repetition)
-            if weight > 0 and items_to_add:
-                dim_options.extend(items_to_add * weight)
 
-        dimensions.append(dim_options)
+def _run_placeholders(parser, text, nested_commands, context):
+    """
+    Lazy mode: executes the nested commands left in the selected text, left to
+    right, each at most once, with the context that precedes the i() call.
+    Escaped characters are put back as they were.
+    """
+    outputs = {}
 
+    def run(match):
+        index = ord(match.group()) - _PLACEHOLDER_BASE
+        if index >= len(nested_commands):
+            return match.group()
+        item = nested_commands[index]
+        if isinstance(item, str):
+            return item
+        if index not in outputs:
+            outputs[index] = item.execute(parser, context=context)
+        return outputs[index]
+
+    return _PLACEHOLDER.sub(run, text)
+
+
+def _select(parser, dimensions, is_dimensional_mode):
     if not is_dimensional_mode:
         # MODE: OPTIONS (OR)
-        all_options = []
-        for dim in dimensions:
-            all_options.extend(dim)
-        if not all_options:
+        total_options = sum(len(dim) for dim in dimensions)
+        if not total_options:
             return ""
-        return all_options[parser.iterator % len(all_options)]
+        position = parser.iterator % total_options
+        for dim in dimensions:
+            if position < len(dim):
+                return dim[position]
+            position -= len(dim)
 
     else:
         # MODE: DIMENSIONS (AND)
@@ -165,22 +295,14 @@ def execute(parser, args, **kwargs):
         if total_permutations == 0:
             return ""
 
+        # Mixed-radix decode, last dimension varying fastest.
         current_step = parser.iterator % total_permutations
-        indices = []
-        divisor = 1
-
+        results = []
         for dim in reversed(dimensions):
             count = len(dim)
             if count == 0:
-                indices.insert(0, 0)
                 continue
-            idx = (current_step // divisor) % count
-            indices.insert(0, idx)
-            divisor *= count
-
-        results = []
-        for dim, idx in zip(dimensions, indices):
-            if dim:
-                results.append(dim[idx])
+            current_step, idx = divmod(current_step, count)
+            results.append(dim[idx])
 
-        return "".join(results)
+        return "".join(reversed(results))
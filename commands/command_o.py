@@ -9,15 +9,21 @@ def execute(parser, args, **kwargs):
     
     filepath = os.path.join(parser.textfiles_directory, os.path.basename(filename))
 
-    if filepath in parser.textfile_cache:
-        return parser.textfile_cache[filepath]
+    # Cached per file version, so an edited file is read again.
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return ""
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = parser.textfile_cache.get(filepath)
+    if cached is not None and cached[0] == version:
+        return cached[1]
 
     try:
-        if os.path.exists(filepath):
-            with open(filepath, 'r', encoding='utf-8') as f:
-                content = f.read()
-                parser.textfile_cache[filepath] = content
-                return content
+        with open(filepath, 'r', encoding='utf-8') as f:
+            content = f.read()
+            parser.textfile_cache[filepath] = (version, content)
+            return content
     except Exception:
         pass
     return ""
\ No newline at end of file
@@ -14,9 +14,8 @@ def _fetch_content(parser, var_name, context=""):
         return str(parser.control_vars_by_name[var_name])
 
     if var_name in parser.box_map:
-        raw_box_content = parser.box_map[var_name]
         # PASS CONTEXT HERE so ?() inside variables can see previous text
-        return parser.parse_fragment(raw_box_content, context=context)
+        return parser.evaluate_box(var_name, context=context)
 
     if var_name in parser.variables:
         return parser.variables[var_name]
@@ -35,6 +34,7 @@ def execute(parser, args, **kwargs):
         var_name = args[0].execute(parser, context=context).strip().lower()
         var_value = args[1].execute(parser, context=context).strip()
         parser.variables[var_name] = var_value
+        parser.box_results.clear()
         return ""
 
     # GET
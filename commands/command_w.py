@@ -1,6 +1,6 @@
 # filename: thoughtbubble/commands/command_w.py
 
-from .utils import parse_weighted_option, fetch_list_source
+from .utils import parse_weighted_option, fetch_sampling_table, static_weight
 
 
 def execute(parser, args, **kwargs):
@@ -8,6 +8,9 @@ def execute(parser, args, **kwargs):
         return ""
     context = kwargs.get("context", "")
 
+    if parser.lazy_branches:
+        return _execute_lazy(parser, args, context)
+
     # 1. Resolve arguments & Parse Weights
     options = []
     weights = []
@@ -30,26 +33,53 @@ def execute(parser, args, **kwargs):
     choice = parser.rng.choices(options, weights=weights, k=1)[0]
 
     # 3. Check for Expansion (Source List)
+    return _expand_choice(parser, choice)
+
+
+def _execute_lazy(parser, args, context):
+    """
+    Lazy mode: weights come from each argument's static ':weight' suffix where
+    possible, and only the chosen argument is executed.
+
+    RNG order: arguments whose weight depends on nested commands are executed
+    first, left to right; then the option draw; then the chosen argument (if
+    it wasn't already executed); then the list-source draw, if any.
+    """
+    weights = []
+    resolved = {}
+    for i, arg in enumerate(args):
+        w = static_weight(arg)
+        if w is None:
+            resolved[i] = arg.execute(parser, context=context)
+            w = parse_weighted_option(resolved[i])[1]
+        weights.append(w)
+
+    if sum(weights) <= 0:
+        return ""
+
+    # Same draw as the eager path: choices() over the argument positions.
+    index = parser.rng.choices(range(len(args)), weights=weights, k=1)[0]
+    if index not in resolved:
+        resolved[index] = args[index].execute(parser, context=context)
+    choice = parse_weighted_option(resolved[index])[0]
+    return _expand_choice(parser, choice)
+
+
+def _expand_choice(parser, choice):
     cleaned = choice.strip()
 
     # Only try to fetch list source if we actually have a key
     if cleaned:
-        expansion_lines = fetch_list_source(parser, cleaned)
-
-        if expansion_lines:
-            # Parse weights for the lines inside the source
-            sub_options = []
-            sub_weights = []
-            for line in expansion_lines:
-                c, w = parse_weighted_option(line)
-                # For wildcards/boxes, we generally still ignore purely empty lines
-                # to avoid accidentally picking blank lines at the end of files.
-                if c:
-                    sub_options.append(c)
-                    sub_weights.append(w)
-
-            if sub_options and sum(sub_weights) > 0:
-                return parser.rng.choices(sub_options, weights=sub_weights, k=1)[0]
+        # The draw table (cumulative weights of the parsed lines) is cached
+        # per source version, so repeated draws don't re-parse every line.
+        expansion_lines, table = fetch_sampling_table(parser, cleaned)
+
+        if table is not None:
+            # For wildcards/boxes, purely empty lines are still ignored to avoid
+            # accidentally picking blank lines at the end of files.
+            if len(table) and table.total > 0:
+                line = expansion_lines[table.choose(parser.rng)]
+                return parse_weighted_option(line)[0]
             return ""
 
     # Return the literal choice (even if it's empty)
@@ -0,0 +1,321 @@
+# filename: thoughtbubble/commands/registry.py
+
+import importlib
+import re
+import threading
+
+# What a command's own result depends on, besides its arguments:
+#   rng        draws from the parser's RNG
+#   iterator   reads the iterator
+#   context    reads the text evaluated before it
+#   canvas     reads boxes, control variables or wildcards
+#   variables  reads variables set with v()
+#   files      reads files that can change between runs
+#   effects    records side outputs (areas, schedules) or sets variables
+NO_DEPENDENCIES = frozenset()
+ALL_DEPENDENCIES = frozenset(
+    ("rng", "iterator", "context", "canvas", "variables", "files", "effects")
+)
+
+
+class CommandSpec:
+    """
+    One command: how it is written and what optimizers may assume about it.
+
+    name              canonical name, as stored in CommandNode.command_name
+    aliases           every spelling accepted before "(" (including `name`)
+    module            module holding `execute`, imported on first use; a
+                      leading "." means relative to this package
+    execute           the handler itself, for commands registered in code
+    arity             (min, max) arguments read; max None for any number
+    dependencies      see the list at the top of this module
+    dependencies_by_arity
+                      overrides for a given argument count, e.g. v(name|value)
+    lazy_arguments    may skip executing some arguments in any mode
+    lazy_with_branches
+                      executes only the chosen argument when lazy_branches is on
+    cost              rough cost of one call: 1 string work, 2 list or box
+                      lookups, 3 file system access
+    builtin           shipped with ThoughtBubble; fingerprint.py knows which
+                      boxes and files these read, and treats any other
+                      command that reads them as able to read all of them
+
+    Commands registered without `dependencies` are assumed to depend on
+    everything, so nothing is folded or memoized around them.
+    """
+
+    __slots__ = (
+        "name",
+        "aliases",
+        "module",
+        "_execute",
+        "arity",
+        "dependencies",
+        "dependencies_by_arity",
+        "lazy_arguments",
+        "lazy_with_branches",
+        "cost",
+        "builtin",
+    )
+
+    def __init__(
+        self,
+        name,
+        module=None,
+        execute=None,
+        aliases=(),
+        arity=(0, None),
+        dependencies=ALL_DEPENDENCIES,
+        dependencies_by_arity=None,
+        lazy_arguments=False,
+        lazy_with_branches=False,
+        cost=1,
+    ):
+        if (module is None) == (execute is None):
+            raise ValueError(
+                f"Command '{name}' needs exactly one of module or execute"
+            )
+        self.name = name.lower()
+        self.aliases = tuple(dict.fromkeys((self.name,) + tuple(aliases)))
+        self.module = module
+        self._execute = execute
+        self.arity = arity
+        self.dependencies = frozenset(dependencies)
+        self.dependencies_by_arity = dependencies_by_arity or {}
+        self.lazy_arguments = lazy_arguments
+        self.lazy_with_branches = lazy_with_branches
+        self.cost = cost
+        self.builtin = False
+
+    @property
+    def handler_name(self):
+        return f"{self.name.upper()}_COMMAND"
+
+    @property
+    def execute(self):
+        if self._execute is None:
+            module = importlib.import_module(self.module, __package__)
+            self._execute = module.execute
+        return self._execute
+
+    def with_execute(self, execute):
+        """A copy of this spec that runs `execute` instead."""
+        spec = CommandSpec(
+            self.name,
+            execute=execute,
+            aliases=self.aliases,
+            arity=self.arity,
+            dependencies=self.dependencies,
+            dependencies_by_arity=self.dependencies_by_arity,
+            lazy_arguments=self.lazy_arguments,
+            lazy_with_branches=self.lazy_with_branches,
+            cost=self.cost,
+        )
+        spec.builtin = self.builtin
+        return spec
+
+    def dependencies_for(self, argument_count):
+        return self.dependencies_by_arity.get(argument_count, self.dependencies)
+
+    @property
+    def uses_rng(self):
+        return "rng" in self.dependencies
+
+    @property
+    def reads_context(self):
+        return "context" in self.dependencies
+
+    @property
+    def reads_iterator(self):
+        """Whether the command reads the iterator with any argument count."""
+        by_arity = self.dependencies_by_arity.values()
+        return any("iterator" in deps for deps in (self.dependencies, *by_arity))
+
+
+class _HandlerTable:
+    """
+    COMMAND_HANDLERS-style view of a registry: "<NAME>_COMMAND" -> execute.
+    Looking a handler up imports its module.
+    """
+
+    def __init__(self, registry):
+        self._registry = registry
+
+    def get(self, handler_name, default=None):
+        spec = self._registry.by_handler_name(handler_name)
+        return spec.execute if spec is not None else default
+
+    def __getitem__(self, handler_name):
+        spec = self._registry.by_handler_name(handler_name)
+        if spec is None:
+            raise KeyError(handler_name)
+        return spec.execute
+
+    def __setitem__(self, handler_name, execute):
+        """Swaps the handler of a registered command, keeping its metadata."""
+        spec = self._registry.by_handler_name(handler_name)
+        if spec is None:
+            raise KeyError(f"{handler_name} is not registered; use register_command")
+        self._registry.register(spec.with_execute(execute))
+
+    def __contains__(self, handler_name):
+        return self._registry.by_handler_name(handler_name) is not None
+
+    def __iter__(self):
+        return iter([spec.handler_name for spec in self._registry.specs()])
+
+    def __len__(self):
+        return len(self._registry.specs())
+
+
+class CommandRegistry:
+    """
+    The commands the parser knows. Registering a command rebuilds the syntax
+    map and token pattern and notifies listeners (the parser clears its tree
+    cache, since text may now parse differently).
+    """
+
+    def __init__(self):
+        self._specs = {}
+        self._aliases = {}
+        self._lock = threading.Lock()
+        self._listeners = []
+        self.handlers = _HandlerTable(self)
+        self.syntax_map = {}
+        self.token_pattern = None
+
+    def register(self, spec):
+        with self._lock:
+            previous = self._specs.get(spec.name)
+            if previous is not None:
+                for alias in previous.aliases:
+                    self._aliases.pop(alias, None)
+            self._specs[spec.name] = spec
+            for alias in spec.aliases:
+                self._aliases[alias] = spec
+            # New dicts instead of in-place updates, so a parser that read
+            # the old ones keeps a consistent pair.
+            self.syntax_map = {
+                alias: spec.handler_name for alias, spec in self._aliases.items()
+            }
+            self.token_pattern = _compile_token_pattern(self.syntax_map)
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener()
+        return spec
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def specs(self):
+        return list(self._specs.values())
+
+    def get(self, name):
+        """The spec for a canonical command name, or None."""
+        return self._specs.get(name)
+
+    def by_handler_name(self, handler_name):
+        if not handler_name.endswith("_COMMAND"):
+            return None
+        return self._specs.get(handler_name[: -len("_COMMAND")].lower())
+
+
+def _compile_token_pattern(syntax_map):
+    sorted_keys = sorted(syntax_map.keys(), key=len, reverse=True)
+    escaped_keys = [re.escape(k) for k in sorted_keys]
+    cmd_pattern = "|".join([f"{k}\\(" for k in escaped_keys])
+    return re.compile(f"({cmd_pattern})|(\\|)|(\\))|(\\()")
+
+
+REGISTRY = CommandRegistry()
+
+
+def register_command(name, **options):
+    """Adds (or replaces) a command; see CommandSpec for the options."""
+    return REGISTRY.register(CommandSpec(name, **options))
+
+
+for _spec in (
+    CommandSpec(
+        "a",
+        ".command_area",
+        aliases=("area",),
+        arity=(1, 1),
+        dependencies=("effects",),
+    ),
+    CommandSpec(
+        "eq",
+        ".command_eq",
+        aliases=("=",),
+        arity=(2, 4),
+        dependencies=NO_DEPENDENCIES,
+        lazy_arguments=True,
+    ),
+    CommandSpec("h", ".command_h", arity=(1, None), dependencies=NO_DEPENDENCIES),
+    CommandSpec(
+        "i",
+        ".command_i",
+        arity=(1, None),
+        dependencies=("iterator", "canvas", "variables", "files"),
+        lazy_with_branches=True,
+        cost=2,
+    ),
+    CommandSpec(
+        "if",
+        ".command_if",
+        aliases=("?",),
+        arity=(2, 3),
+        dependencies=("context", "variables"),
+        lazy_arguments=True,
+    ),
+    CommandSpec(
+        "lora",
+        ".command_lora",
+        aliases=("lra",),
+        arity=(1, 1),
+        dependencies=NO_DEPENDENCIES,
+    ),
+    CommandSpec(
+        "embed",
+        ".command_embed",
+        arity=(1, 1),
+        dependencies=("files",),
+        cost=3,
+    ),
+    CommandSpec(
+        "multi_if",
+        ".command_multi_if",
+        aliases=("??",),
+        arity=(1, None),
+        dependencies=("context", "variables"),
+        lazy_arguments=True,
+    ),
+    CommandSpec(
+        "neg",
+        ".command_neg",
+        aliases=("-",),
+        arity=(1, None),
+        dependencies=NO_DEPENDENCIES,
+    ),
+    CommandSpec("o", ".command_o", arity=(1, 1), dependencies=("files",), cost=3),
+    CommandSpec("r", ".command_r", arity=(1, 2), dependencies=("rng",)),
+    CommandSpec("t", ".command_t", arity=(2, 3), dependencies=("effects",)),
+    CommandSpec(
+        "v",
+        ".command_v",
+        arity=(1, 2),
+        dependencies=("canvas", "variables"),
+        dependencies_by_arity={2: frozenset(("effects",))},
+        cost=2,
+    ),
+    CommandSpec(
+        "w",
+        ".command_w",
+        arity=(1, None),
+        dependencies=("rng", "canvas", "variables", "files"),
+        lazy_with_branches=True,
+        cost=2,
+    ),
+):
+    _spec.builtin = True
+    REGISTRY.register(_spec)
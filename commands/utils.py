@@ -1,7 +1,18 @@
 # filename: thoughtbubble/commands/command_utils.py or just utils.py
 # (Keeping filename as utils.py based on previous context)
 
-import re
+import math
+from array import array
+from bisect import bisect, bisect_right
+
+from ..caches import LRUCache
+from ..context import EvalContext, word_pattern
+
+# Per-source tables (SamplingTable / CountTable), keyed by table type and
+# source version. Shared by every parser and reused across queues.
+SOURCE_TABLES = LRUCache(max_bytes=256 * 1024 * 1024, sizeof=lambda t: t.nbytes)
+# Non-empty lines of box / variable text, keyed by the text itself.
+_TEXT_LINES = LRUCache(max_entries=256)
 
 
 def parse_weight(weight_str):
@@ -36,33 +47,177 @@ def parse_weighted_option(text):
     return content, max(0.0, weight)
 
 
+def static_text(node):
+    """
+    Returns the text of an argument node made only of literal text, or None
+    if executing it could run a nested command.
+    """
+    children = getattr(node, "children", None)
+    if children is None:
+        return getattr(node, "text", None)
+    parts = []
+    for child in children:
+        text = getattr(child, "text", None)
+        if text is None:
+            return None
+        parts.append(text)
+    return "".join(parts)
+
+
+def static_weight(node):
+    """
+    Returns the weight parse_weighted_option would read from the argument's
+    result, or None if it can't be known without executing the argument.
+    The weight is static when the argument is pure text, or when its trailing
+    literal text holds the last ':' (nothing after it can add another one).
+    """
+    text = static_text(node)
+    if text is not None:
+        return parse_weighted_option(text)[1]
+    last_text = getattr(node.children[-1], "text", None)
+    if last_text is not None and ":" in last_text:
+        return parse_weighted_option(last_text)[1]
+    return None
+
+
+class SamplingTable:
+    """
+    Cumulative weights for drawing one line of a list source.
+    Lines with empty content are skipped, as w() has always done.
+    choose() consumes a single rng.random() and picks the same line as
+    rng.choices(options, weights=weights, k=1) over the parsed lines.
+    """
+
+    __slots__ = ("indices", "cum_weights", "total")
+
+    def __init__(self, lines):
+        self.indices = array("Q")
+        self.cum_weights = array("d")
+        running = 0.0
+        for i, line in enumerate(lines):
+            content, weight = parse_weighted_option(line)
+            if content:
+                running += weight
+                self.indices.append(i)
+                self.cum_weights.append(running)
+        self.total = running + 0.0
+
+    @property
+    def nbytes(self):
+        return (
+            self.indices.itemsize * len(self.indices)
+            + self.cum_weights.itemsize * len(self.cum_weights)
+        )
+
+    def __len__(self):
+        return len(self.indices)
+
+    def choose(self, rng):
+        """Returns the index of the chosen line."""
+        if not math.isfinite(self.total):
+            raise ValueError("Total of weights must be finite")
+        position = bisect(
+            self.cum_weights, rng.random() * self.total, 0, len(self.indices) - 1
+        )
+        return self.indices[position]
+
+
+class CountTable:
+    """
+    Repetition counts used by i(): line i stands for int(weight) consecutive
+    entries and lines with a count below 1 are dropped. locate() maps an entry
+    position to its line without materializing the repeated list.
+    """
+
+    __slots__ = ("indices", "cum_counts", "total")
+
+    def __init__(self, lines):
+        self.indices = array("Q")
+        self.cum_counts = array("Q")
+        running = 0
+        for i, line in enumerate(lines):
+            count = int(parse_weighted_option(line)[1])
+            if count > 0:
+                running += count
+                self.indices.append(i)
+                try:
+                    self.cum_counts.append(running)
+                except OverflowError:
+                    self.cum_counts = list(self.cum_counts) + [running]
+        self.total = running
+
+    @property
+    def nbytes(self):
+        return 8 * (len(self.indices) + len(self.cum_counts))
+
+    def locate(self, position):
+        """Returns the line index of entry `position` (0 <= position < total)."""
+        return self.indices[bisect_right(self.cum_counts, position)]
+
+
+def _split_lines(text):
+    lines = _TEXT_LINES.get(text)
+    if lines is None:
+        lines = [l for l in text.split("\n") if l.strip()]
+        _TEXT_LINES.put(text, lines)
+    return lines
+
+
+def _resolve_list_source(parser, key):
+    """Returns (lines, version) for 'key', or (None, None). See fetch_list_source."""
+    key = key.lower().strip()
+
+    # 1. Wildcards (a sequence-like view; lines are read on demand)
+    wildcard_lines = parser.wildcards.get(key)
+    if wildcard_lines is not None:
+        version = getattr(wildcard_lines, "version", None)
+        if version is None:
+            return wildcard_lines, None
+        return wildcard_lines, ("file", wildcard_lines.path) + version
+
+    # 2. Text Boxes, 3. Control Variables (Node Inputs), 4. Dynamic Variables (v_set)
+    for source in (parser.box_map, parser.control_vars_by_name, parser.variables):
+        if key in source:
+            text = str(source[key])
+            return _split_lines(text), ("text", text)
+
+    return None, None
+
+
 def fetch_list_source(parser, key):
     """
     Checks all data sources for a list-like entity matching 'key'.
-    Returns a list of strings (lines) if found, or None.
+    Returns a sequence of strings (lines) if found, or None.
     Sources checked: Wildcards -> Boxes -> Control Vars -> Dynamic Vars
     """
-    key = key.lower().strip()
+    return _resolve_list_source(parser, key)[0]
 
-    # 1. Wildcards
-    if key in parser.wildcards:
-        return parser.wildcards[key]
 
-    # 2. Text Boxes
-    if key in parser.box_map:
-        return [l for l in parser.box_map[key].split("\n") if l.strip()]
+def _fetch_table(parser, key, table_type):
+    lines, version = _resolve_list_source(parser, key)
+    if not lines:
+        return lines, None
+    cache_key = (table_type.__name__,) + version if version is not None else None
+    table = SOURCE_TABLES.get(cache_key) if cache_key is not None else None
+    if table is None:
+        table = table_type(lines)
+        if cache_key is not None:
+            SOURCE_TABLES.put(cache_key, table)
+    return lines, table
 
-    # 3. Control Variables (Node Inputs)
-    if key in parser.control_vars_by_name:
-        val = str(parser.control_vars_by_name[key])
-        return [l for l in val.split("\n") if l.strip()]
 
-    # 4. Dynamic Variables (v_set)
-    if key in parser.variables:
-        val = str(parser.variables[key])
-        return [l for l in val.split("\n") if l.strip()]
+def fetch_sampling_table(parser, key):
+    """
+    Like fetch_list_source, but also returns the SamplingTable for the source.
+    Returns (lines, table); table is None when the source is missing or empty.
+    Tables are built once per source version and shared across draws and queues.
+    """
+    return _fetch_table(parser, key, SamplingTable)
 
-    return None
+
+def fetch_count_table(parser, key):
+    """Same as fetch_sampling_table, returning the CountTable used by i()."""
+    return _fetch_table(parser, key, CountTable)
 
 
 def check_condition(parser, condition_str, context):
@@ -84,7 +239,9 @@ def check_condition(parser, condition_str, context):
             return True
 
     # 2. Context / Weight Check
-    context_lower = context.lower()
+    # context is usually the shared EvalContext, which answers whole-word
+    # lookups from its word index; plain strings fall back to a regex search.
+    context_lower = None
     total_weight = 0.0
     has_match_attempt = False
 
@@ -108,7 +265,13 @@ def check_condition(parser, condition_str, context):
             continue
 
         has_match_attempt = True
-        if re.search(r"\b" + re.escape(word) + r"\b", context_lower):
+        if isinstance(context, EvalContext):
+            found = context.contains_word(word)
+        else:
+            if context_lower is None:
+                context_lower = context.lower()
+            found = word_pattern(word).search(context_lower) is not None
+        if found:
             total_weight += parse_weight(weight_str)
 
     if has_match_attempt and total_weight >= 1.0:
@@ -0,0 +1,413 @@
+# filename: thoughtbubble/conditioning.py
+
+import hashlib
+import os
+import torch
+from .caches import LRUCache
+from .disk_cache import ConditioningDiskCache
+from .identity import object_token, patcher_identity
+
+# Upper bound on token sections (77 tokens each for CLIP) per forward pass.
+MAX_BATCH_SECTIONS = 16
+
+# Encoder variant -> whether a batched call returns one pooled output per
+# section. Stock ComfyUI encoders only return the first section's, so each
+# prompt's pooled output then comes from a pass over its first section.
+_POOLED_PER_SECTION = {}
+
+
+def conditioning_nbytes(conditioning):
+    total = 0
+    for cond, extra in conditioning:
+        total += cond.element_size() * cond.nelement()
+        pooled = extra.get("pooled_output")
+        if pooled is not None:
+            total += pooled.element_size() * pooled.nelement()
+    return total
+
+
+# Process-wide cache of encoded prompts, one entry per
+# (clip identity, prompt text). The tensor budget can be set
+# with the THOUGHTBUBBLE_CONDITIONING_CACHE_MB environment variable.
+CONDITIONING_CACHE = LRUCache(
+    max_bytes=int(os.environ.get("THOUGHTBUBBLE_CONDITIONING_CACHE_MB", "512"))
+    * 1024
+    * 1024,
+    sizeof=conditioning_nbytes,
+)
+
+# (tokenizer identity, text) -> token dicts as returned by tokenize(), with the
+# l/g pair of a dual CLIP already padded. TOKEN_CACHE.stats() has the hit rate.
+TOKEN_CACHE = LRUCache(max_entries=2048)
+
+# Optional second tier that survives restarts; see enable_disk_cache().
+DISK_CACHE = None
+# Encoding this text identifies a CLIP's weights (LoRAs included) for the
+# disk tier, where object identities from an earlier process mean nothing.
+_FINGERPRINT_TEXT = "a photograph of an astronaut riding a horse, oil painting"
+_FINGERPRINTS = LRUCache(max_entries=64)
+
+
+def enable_disk_cache(directory, max_bytes):
+    global DISK_CACHE
+    if DISK_CACHE is None or DISK_CACHE.directory != directory:
+        DISK_CACHE = ConditioningDiskCache(directory, max_bytes)
+    DISK_CACHE.max_bytes = max_bytes
+    return DISK_CACHE
+
+
+def is_dual_clip(clip):
+    return hasattr(clip, "clip_l") and hasattr(clip, "clip_g")
+
+
+def encoder_variant(clip):
+    """Identifies the kind of text encoder behind a CLIP object."""
+    if is_dual_clip(clip):
+        return ("dual", type(clip.clip_l).__name__, type(clip.clip_g).__name__)
+    model = getattr(clip, "cond_stage_model", clip)
+    return ("single", type(model).__name__)
+
+
+def clip_identity(clip):
+    """
+    Key part that tells CLIP objects (and their LoRA patch states) apart, or
+    None if the CLIP can't be cached on.
+    """
+    identity = patcher_identity(clip)
+    if identity is None:
+        return None
+    return (identity, encoder_variant(clip))
+
+
+def clip_fingerprint(clip):
+    """
+    Hash of the CLIP's output for a fixed probe text, so two CLIPs only share
+    a fingerprint if they encode identically. Computed once per CLIP object.
+    """
+    identity = clip_identity(clip)
+    fingerprint = _FINGERPRINTS.get(identity) if identity is not None else None
+    if fingerprint is None:
+        digest = hashlib.sha256(repr(encoder_variant(clip)).encode("utf-8"))
+        for cond, extra in encode_texts(clip, [_FINGERPRINT_TEXT])[_FINGERPRINT_TEXT]:
+            for tensor in (cond, extra.get("pooled_output")):
+                if tensor is not None:
+                    tensor = tensor.detach().to("cpu", torch.float32).contiguous()
+                    digest.update(repr(tuple(tensor.shape)).encode("utf-8"))
+                    digest.update(tensor.numpy().tobytes())
+        fingerprint = digest.hexdigest()[:32]
+        if identity is not None:
+            _FINGERPRINTS.put(identity, fingerprint)
+    return fingerprint
+
+
+def reads_embeddings(text):
+    """
+    Whether tokenizing `text` loads embedding files. They are read from disk
+    on every tokenize and can be replaced, so such texts are never cached.
+    """
+    return "embedding:" in text
+
+
+def get_conditioning(clip, texts):
+    """
+    Cached front end for encode_texts(): returns {text: conditioning} for every
+    non-empty text, encoding only the ones found in neither CONDITIONING_CACHE
+    nor the disk tier. Texts that use embeddings skip both and are always
+    encoded.
+    """
+    identity = clip_identity(clip)
+    results, missing = {}, []
+    for text in dict.fromkeys(texts):
+        if not text:
+            continue
+        conditioning = None
+        if identity is not None and not reads_embeddings(text):
+            conditioning = CONDITIONING_CACHE.get((identity, text))
+        if conditioning is None:
+            missing.append(text)
+        else:
+            results[text] = conditioning
+    if not missing:
+        return results
+
+    disk_cache, fingerprint = DISK_CACHE, None
+    if disk_cache is not None:
+        fingerprint = clip_fingerprint(clip)
+        still_missing = []
+        for text in missing:
+            if reads_embeddings(text):
+                still_missing.append(text)
+                continue
+            conditioning = disk_cache.get(fingerprint, text)
+            if conditioning is None:
+                still_missing.append(text)
+            else:
+                if identity is not None and not reads_embeddings(text):
+                    CONDITIONING_CACHE.put((identity, text), conditioning)
+                results[text] = conditioning
+        missing = still_missing
+
+    for text, conditioning in encode_texts(clip, missing).items():
+        if identity is not None and not reads_embeddings(text):
+            CONDITIONING_CACHE.put((identity, text), conditioning)
+        if disk_cache is not None and not reads_embeddings(text):
+            disk_cache.put(fingerprint, text, conditioning)
+        results[text] = conditioning
+    return results
+
+
+def tokenizer_identity(clip):
+    """
+    Key part for TOKEN_CACHE: the tokenizer object(s) behind a CLIP plus its
+    tokenizer_options, or None if they can't be cached on.
+    """
+    if is_dual_clip(clip):
+        tokenizers = (
+            getattr(clip.clip_l, "tokenizer", clip.clip_l),
+            getattr(clip.clip_g, "tokenizer", clip.clip_g),
+        )
+    else:
+        tokenizers = (getattr(clip, "tokenizer", clip),)
+    tokens = tuple(object_token(tokenizer) for tokenizer in tokenizers)
+    if None in tokens:
+        return None
+    # Clones of a CLIP share its tokenizer, but not the options set on them.
+    options = getattr(clip, "tokenizer_options", None)
+    if options:
+        tokens += (repr(sorted(options.items())),)
+    return tokens
+
+
+def tokenize(clip, text):
+    """
+    Returns the token dicts for one prompt: (tokens,) for a regular CLIP,
+    (tokens_l, tokens_g) padded to the same length for a dual CLIP.
+    Results are cached per tokenizer (except for texts that use embeddings);
+    callers must not modify them.
+    """
+    identity = tokenizer_identity(clip)
+    if identity is None or reads_embeddings(text):
+        return _tokenize(clip, text)
+    key = (identity, text)
+    tokens = TOKEN_CACHE.get(key)
+    if tokens is None:
+        tokens = _tokenize(clip, text)
+        TOKEN_CACHE.put(key, tokens)
+    return tokens
+
+
+def _tokenize(clip, text):
+    if not is_dual_clip(clip):
+        return (clip.tokenize(text),)
+
+    tokens_l = clip.clip_l.tokenize(text)
+    tokens_g = clip.clip_g.tokenize(text)
+
+    max_len = max(len(tokens_l["l"]), len(tokens_g["g"]))
+
+    if len(tokens_l["l"]) < max_len:
+        tokens_l["l"] = tokens_l["l"] + [tokens_l["l"][-1]] * (
+            max_len - len(tokens_l["l"])
+        )
+
+    if len(tokens_g["g"]) < max_len:
+        tokens_g["g"] = tokens_g["g"] + [tokens_g["g"][-1]] * (
+            max_len - len(tokens_g["g"])
+        )
+
+    return (tokens_l, tokens_g)
+
+
+def encode_texts(clip, texts, max_batch_sections=None):
+    """
+    Encodes several prompts with as few forward passes as possible.
+
+    Empty and duplicate texts are dropped, prompts whose token sections have
+    the same shape are concatenated into shared batches of at most
+    `max_batch_sections` sections, and the encoder output is split back per
+    prompt. Returns {text: conditioning}, where each conditioning has the same
+    format (and values) as encoding the text on its own.
+    """
+    max_sections = max_batch_sections or MAX_BATCH_SECTIONS
+    unique = [text for text in dict.fromkeys(texts) if text]
+    if not unique:
+        return {}
+    tokens = {text: tokenize(clip, text) for text in unique}
+    variant = encoder_variant(clip)
+
+    if is_dual_clip(clip):
+        # clip_l's pooled output is unused, so that pass always batches.
+        encoded_l = _encode_all(
+            clip.clip_l, [(t, tokens[t][0]) for t in unique], max_sections, None
+        )
+        encoded_g = _encode_all(
+            clip.clip_g, [(t, tokens[t][1]) for t in unique], max_sections, variant
+        )
+        return {
+            text: [
+                [
+                    torch.cat((encoded_l[text][0], encoded_g[text][0]), dim=-1),
+                    {"pooled_output": encoded_g[text][1]},
+                ]
+            ]
+            for text in unique
+        }
+
+    encoded = _encode_all(
+        clip, [(t, tokens[t][0]) for t in unique], max_sections, variant
+    )
+    return {
+        text: [[cond, {"pooled_output": pooled}]]
+        for text, (cond, pooled) in encoded.items()
+    }
+
+
+def _signature(tokens):
+    """
+    Batch compatibility key for one token dict, or None if its sections are
+    ragged and cannot share a batch with anything.
+    """
+    counts, lengths = set(), []
+    for key in sorted(tokens):
+        sections = tokens[key]
+        if not sections:
+            return None
+        section_lengths = {len(section) for section in sections}
+        if len(section_lengths) != 1:
+            return None
+        counts.add(len(sections))
+        lengths.append((key, section_lengths.pop()))
+    if len(counts) != 1:
+        return None
+    return tuple(lengths)
+
+
+def _encode_all(encoder, items, max_sections, pooled_variant):
+    """
+    Encodes (text, tokens) items, batching compatible ones.
+    `pooled_variant` is None when the pooled output isn't needed.
+    Returns {text: (cond, pooled)}.
+    """
+    results = {}
+    groups = {}
+    for text, tokens in items:
+        signature = _signature(tokens)
+        if signature is None:
+            results[text] = _encode_one(encoder, tokens, pooled_variant is not None)
+        else:
+            groups.setdefault(signature, []).append((text, tokens))
+
+    for group in groups.values():
+        # Prompts are padded to the longest one in their chunk, so chunking
+        # them by section count keeps the padding small.
+        group.sort(key=lambda item: _section_count(item[1]))
+        chunk = []
+        for text, tokens in group:
+            if chunk and _section_count(tokens) * (len(chunk) + 1) > max_sections:
+                _encode_chunk(encoder, chunk, pooled_variant, results)
+                chunk = []
+            chunk.append((text, tokens))
+        if chunk:
+            _encode_chunk(encoder, chunk, pooled_variant, results)
+    return results
+
+
+def _section_count(tokens):
+    return len(next(iter(tokens.values())))
+
+
+def _encode_chunk(encoder, chunk, pooled_variant, results):
+    want_pooled = pooled_variant is not None
+    if want_pooled and _POOLED_PER_SECTION.get(pooled_variant) is False:
+        _encode_first_sections_apart(encoder, chunk, results)
+        return
+    if len(chunk) == 1:
+        text, tokens = chunk[0]
+        results[text] = _encode_one(encoder, tokens, want_pooled)
+        return
+
+    # Every prompt gets the same number of sections (padded with copies of
+    # its last one, like _tokenize pads l and g), so prompt i owns sections
+    # [i * sections, (i + 1) * sections) of the output.
+    sections = max(_section_count(tokens) for _, tokens in chunk)
+    batch = {
+        key: [
+            section
+            for _, tokens in chunk
+            for section in tokens[key]
+            + [tokens[key][-1]] * (sections - len(tokens[key]))
+        ]
+        for key in chunk[0][1]
+    }
+    try:
+        cond, pooled = _encode(encoder, batch, want_pooled)
+    except Exception as e:
+        print(f"Thought Bubble Warning: Batched encoding failed, encoding one by one: {e}")
+        cond = None
+
+    total = sections * len(chunk)
+    if cond is None or cond.shape[-2] % total != 0:
+        for text, tokens in chunk:
+            results[text] = _encode_one(encoder, tokens, want_pooled)
+        return
+    if want_pooled:
+        per_section = pooled is not None and pooled.shape[0] == total
+        _POOLED_PER_SECTION[pooled_variant] = per_section
+        if not per_section:
+            # The conds are still good; only the pooled outputs are missing.
+            pooled = None
+
+    width = cond.shape[-2] // total
+    for index, (text, tokens) in enumerate(chunk):
+        start = index * sections
+        text_cond = cond.narrow(-2, start * width, _section_count(tokens) * width)
+        text_pooled = None
+        if want_pooled:
+            if pooled is not None:
+                text_pooled = pooled[start : start + 1].clone()
+            else:
+                _, text_pooled = _encode_one(encoder, _first_section(tokens), True)
+        results[text] = (text_cond.clone(), text_pooled)
+
+
+def _encode_first_sections_apart(encoder, chunk, results):
+    """
+    For encoders that only return the first section's pooled output: each
+    prompt's first section is encoded on its own, which gives its pooled
+    output, and the remaining sections of all prompts share batches.
+    """
+    rests = [
+        (text, {key: sections[1:] for key, sections in tokens.items()})
+        for text, tokens in chunk
+        if _section_count(tokens) > 1
+    ]
+    rest_results = {}
+    if rests:
+        _encode_chunk(encoder, rests, None, rest_results)
+    for text, tokens in chunk:
+        cond, pooled = _encode_one(encoder, _first_section(tokens), True)
+        if text in rest_results:
+            cond = torch.cat((cond, rest_results[text][0]), dim=-2)
+        results[text] = (cond, pooled)
+
+
+def _first_section(tokens):
+    return {key: sections[:1] for key, sections in tokens.items()}
+
+
+def _encode(encoder, tokens, return_pooled):
+    """
+    encode_from_tokens as (cond, pooled). ComfyUI returns a bare cond unless
+    the pooled output is requested.
+    """
+    output = encoder.encode_from_tokens(tokens, return_pooled=return_pooled)
+    if isinstance(output, tuple):
+        return output[0], output[1]
+    return output, None
+
+
+def _encode_one(encoder, tokens, want_pooled):
+    cond, pooled = _encode(encoder, tokens, want_pooled)
+    if not want_pooled or pooled is None:
+        return cond.clone(), None
+    return cond.clone(), pooled.clone()
@@ -0,0 +1,196 @@
+# filename: thoughtbubble/context.py
+
+import re
+from bisect import bisect_right
+from functools import lru_cache
+
+_WORD_RUN = re.compile(r"\w+")
+_WORD_CHAR = re.compile(r"\w")
+
+
+@lru_cache(maxsize=1024)
+def word_pattern(word):
+    """Compiled whole-word pattern for a (lowercase) condition word."""
+    return re.compile(r"\b" + re.escape(word) + r"\b")
+
+
+class EvalContext:
+    """
+    Append-only text buffer holding everything evaluated so far.
+
+    A single instance is shared by reference down the whole tree: a
+    CompositeNode appends each child's result as it goes and truncates back
+    to its starting mark when it is done, so nested commands see exactly the
+    text that precedes them without the buffer ever being copied.
+    The joined text is built lazily and reused until the buffer changes. Each
+    chunk is lowercased once, and an incremental index of word runs over the
+    lowercase chunks answers whole-word lookups for ?()/??() without joining
+    or rescanning the text.
+    """
+
+    __slots__ = (
+        "_chunks",
+        "_text",
+        "_lower",
+        "_lower_chunks",
+        "_lower_ends",
+        "_sigma_chunk",
+        "_runs",
+        "_run_starts",
+        "_indexed_upto",
+    )
+
+    def __init__(self, text=""):
+        self._chunks = [text] if text else []
+        self._text = None
+        # Lowercase copies of the first len(_lower_chunks) chunks, making up
+        # the lowercase view; _lower_ends[i] is the end offset of chunk i in
+        # it. They are only joined (into _lower) when lower() is called.
+        self._lower_chunks = []
+        self._lower_ends = []
+        self._lower = None
+        # str.lower() is not chunk-wise for a final sigma, so while a chunk
+        # containing one is in the buffer (this is its index), the joined
+        # text is lowered instead.
+        self._sigma_chunk = None
+        # Word index over the lowercase view: _runs holds (start, end, word)
+        # in text order, _run_starts maps each word to its start offsets.
+        self._runs = []
+        self._run_starts = {}
+        self._indexed_upto = 0
+
+    def append(self, text):
+        if text:
+            self._chunks.append(text)
+            self._text = None
+
+    def mark(self):
+        return len(self._chunks)
+
+    def truncate(self, mark):
+        if mark >= len(self._chunks):
+            return
+        del self._chunks[mark:]
+        self._text = None
+        if self._sigma_chunk is not None and self._sigma_chunk >= mark:
+            self._sigma_chunk = None
+        if len(self._lower_chunks) > mark:
+            del self._lower_chunks[mark:]
+            del self._lower_ends[mark:]
+            self._lower = None
+            self._drop_runs_after(self._lower_ends[-1] if mark else 0)
+
+    def __str__(self):
+        if self._text is None:
+            self._text = "".join(self._chunks)
+        return self._text
+
+    def __len__(self):
+        return len(str(self))
+
+    def lower(self):
+        if not self._lower_new_chunks():
+            return str(self).lower()
+        if self._lower is None:
+            self._lower = "".join(self._lower_chunks)
+        return self._lower
+
+    def _lower_new_chunks(self):
+        """Lowers the chunks appended since the last call; False on a sigma."""
+        if self._sigma_chunk is not None:
+            return False
+        covered = len(self._lower_chunks)
+        if covered < len(self._chunks):
+            self._lower = None
+            offset = self._lower_ends[-1] if covered else 0
+            for index in range(covered, len(self._chunks)):
+                chunk = self._chunks[index]
+                if "\u03a3" in chunk:
+                    self._sigma_chunk = index
+                    return False
+                lowered = chunk.lower()
+                offset += len(lowered)
+                self._lower_chunks.append(lowered)
+                self._lower_ends.append(offset)
+        return True
+
+    def _lower_slice(self, start, end):
+        """self.lower()[start:end], joining only the chunks it spans."""
+        index = bisect_right(self._lower_ends, start)
+        base = self._lower_ends[index - 1] if index else 0
+        parts = []
+        while index < len(self._lower_chunks) and (
+            not parts or self._lower_ends[index - 1] < end
+        ):
+            parts.append(self._lower_chunks[index])
+            index += 1
+        return "".join(parts)[start - base : end - base]
+
+    def contains_word(self, word):
+        """
+        Same result as word_pattern(word).search(self.lower()), answered from
+        the word index whenever the word starts and ends with word characters.
+        """
+        if (
+            not _WORD_CHAR.match(word)
+            or not _WORD_CHAR.match(word[-1])
+            or not self._update_index()
+        ):
+            return word_pattern(word).search(self.lower()) is not None
+
+        first_run = _WORD_RUN.match(word).group()
+        starts = self._run_starts.get(first_run)
+        if not starts:
+            return False
+        if len(first_run) == len(word):
+            return True
+        # Multi-word phrase: each start is already a word boundary, so only
+        # the rest of the phrase and the closing boundary need checking.
+        for start in starts:
+            text = self._lower_slice(start, start + len(word) + 1)
+            if text.startswith(word) and not _WORD_CHAR.match(text, len(word)):
+                return True
+        return False
+
+    def _update_index(self):
+        """Indexes the newly lowered chunks; False if lower() must be used."""
+        if not self._lower_new_chunks():
+            return False
+        end = self._lower_ends[-1] if self._lower_ends else 0
+        position = self._indexed_upto
+        if position == end:
+            return True
+        # The last run may continue into the newly appended text.
+        if self._runs and self._runs[-1][1] == position:
+            position = self._runs[-1][0]
+            self._pop_run()
+        index = bisect_right(self._lower_ends, position)
+        base = self._lower_ends[index - 1] if index else 0
+        tail = "".join(self._lower_chunks[index:])
+        for match in _WORD_RUN.finditer(tail, position - base):
+            word = match.group()
+            start = base + match.start()
+            self._runs.append((start, base + match.end(), word))
+            self._run_starts.setdefault(word, []).append(start)
+        self._indexed_upto = end
+        return True
+
+    def _pop_run(self):
+        _, _, word = self._runs.pop()
+        starts = self._run_starts[word]
+        starts.pop()
+        if not starts:
+            del self._run_starts[word]
+
+    def _drop_runs_after(self, length):
+        if self._indexed_upto <= length:
+            return
+        while self._runs and self._runs[-1][1] > length:
+            self._pop_run()
+        self._indexed_upto = self._runs[-1][1] if self._runs else 0
+
+
+def as_context(context):
+    if isinstance(context, EvalContext):
+        return context
+    return EvalContext(context or "")
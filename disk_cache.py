@@ -0,0 +1,187 @@
+# filename: thoughtbubble/disk_cache.py
+
+import hashlib
+import json
+import os
+import struct
+import threading
+import torch
+
+# safetensors dtype names for the dtypes text encoders produce.
+_DTYPES = {
+    torch.float32: "F32",
+    torch.float16: "F16",
+    torch.bfloat16: "BF16",
+    torch.float64: "F64",
+}
+_DTYPES_BY_NAME = {name: dtype for dtype, name in _DTYPES.items()}
+_HEADER_SIZE = struct.Struct("<Q")
+
+
+def prompt_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+def write_safetensors(path, tensors, metadata):
+    """Writes `tensors` ({name: tensor}) in the safetensors file format."""
+    header = {"__metadata__": metadata}
+    blobs, offset = [], 0
+    for name, tensor in tensors.items():
+        tensor = tensor.detach().to("cpu").contiguous()
+        data = tensor.view(-1).view(torch.uint8).numpy().tobytes()
+        header[name] = {
+            "dtype": _DTYPES[tensor.dtype],
+            "shape": list(tensor.shape),
+            "data_offsets": [offset, offset + len(data)],
+        }
+        blobs.append(data)
+        offset += len(data)
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    # The data section starts 8-byte aligned.
+    header_bytes += b" " * (-len(header_bytes) % 8)
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(_HEADER_SIZE.pack(len(header_bytes)))
+        f.write(header_bytes)
+        for data in blobs:
+            f.write(data)
+    os.replace(temp_path, path)
+
+
+def read_safetensors(path):
+    """
+    Reads a safetensors file and returns (tensors, metadata). The tensors are
+    views of one in-memory copy and the file is closed before returning, so
+    it can be replaced or deleted while they are in use (Windows can't do
+    either to an open or mapped file).
+    """
+    with open(path, "rb") as f:
+        data = bytearray(f.read())
+    (header_size,) = _HEADER_SIZE.unpack_from(data)
+    header = json.loads(data[8 : 8 + header_size])
+    metadata = header.pop("__metadata__", {})
+    base = 8 + header_size
+    tensors = {}
+    for name, info in header.items():
+        dtype = _DTYPES_BY_NAME[info["dtype"]]
+        start, end = info["data_offsets"]
+        if end == start:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        flat = torch.frombuffer(
+            data, dtype=torch.uint8, count=end - start, offset=base + start
+        )
+        tensors[name] = flat.view(dtype).view(info["shape"])
+    return tensors, metadata
+
+
+class ConditioningDiskCache:
+    """
+    On-disk tier for encoded prompts.
+
+    Each prompt is stored as `<fingerprint>-<prompt hash>.safetensors`, holding
+    the cond and pooled_output tensors plus the fingerprint and the prompt
+    itself as metadata, which are checked again on load. The directory is kept
+    under `max_bytes` by deleting the least recently used files.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._sizes = None
+        self._lock = threading.Lock()
+
+    def _path(self, fingerprint, text):
+        return os.path.join(
+            self.directory, f"{fingerprint}-{prompt_hash(text)}.safetensors"
+        )
+
+    def get(self, fingerprint, text):
+        path = self._path(fingerprint, text)
+        try:
+            tensors, metadata = read_safetensors(path)
+            if (
+                metadata.get("fingerprint") != fingerprint
+                or metadata.get("prompt") != text
+                or "cond" not in tensors
+            ):
+                self.misses += 1
+                return None
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (OSError, ValueError, KeyError, RuntimeError, struct.error) as e:
+            print(f"Thought Bubble Warning: Discarding unreadable cache file '{path}': {e}")
+            self._remove(path)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return [[tensors["cond"], {"pooled_output": tensors.get("pooled_output")}]]
+
+    def put(self, fingerprint, text, conditioning):
+        cond, extra = conditioning[0]
+        tensors = {"cond": cond}
+        if extra.get("pooled_output") is not None:
+            tensors["pooled_output"] = extra["pooled_output"]
+        path = self._path(fingerprint, text)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            write_safetensors(
+                path, tensors, {"fingerprint": fingerprint, "prompt": text}
+            )
+            size = os.path.getsize(path)
+        except (OSError, KeyError) as e:
+            print(f"Thought Bubble Warning: Could not write conditioning cache: {e}")
+            return
+        with self._lock:
+            sizes = self._scan()
+            sizes[path] = size
+            self._evict(sizes)
+
+    def _scan(self):
+        if self._sizes is None:
+            self._sizes = {}
+            try:
+                for filename in os.listdir(self.directory):
+                    if filename.endswith(".safetensors"):
+                        path = os.path.join(self.directory, filename)
+                        self._sizes[path] = os.path.getsize(path)
+            except OSError:
+                pass
+        return self._sizes
+
+    def _evict(self, sizes):
+        total = sum(sizes.values())
+        if total <= self.max_bytes:
+            return
+        by_age = []
+        for path in sizes:
+            try:
+                by_age.append((os.path.getmtime(path), path))
+            except OSError:
+                by_age.append((0, path))
+        for _, path in sorted(by_age):
+            if total <= self.max_bytes:
+                break
+            size = sizes[path]
+            if self._remove(path):
+                total -= size
+
+    def _remove(self, path):
+        """
+        Deletes a cache file. Its size stays counted until the file is gone,
+        so a file that can't be deleted yet is tried again on the next put().
+        """
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return False
+        if self._sizes is not None:
+            self._sizes.pop(path, None)
+        return True
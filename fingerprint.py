@@ -0,0 +1,170 @@
+# filename: thoughtbubble/fingerprint.py
+
+import hashlib
+import json
+import os
+import re
+from .commands import REGISTRY
+from .commands.command_i import _expand_options
+from .commands.utils import parse_weighted_option, static_text
+from .name_index import get_name_index
+from .parser import CanvasParser, CommandNode, CompositeNode
+
+# What a command can read that is followed into boxes and files below. Any
+# other command reading them makes the canvas dynamic.
+_FOLLOWED_DEPENDENCIES = frozenset(("canvas", "files"))
+
+# Same split as the GET form of v().
+_VAR_TOKENS = re.compile(r"([+-]?)\s*([^\s+-]\S*)")
+
+# Only used to build trees, which land in the shared parser.AST_CACHE.
+_TREE_BUILDER = CanvasParser({}, {}, "", None)
+
+
+def file_version(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+class _Dependencies:
+    """
+    The files a canvas evaluation can read, found by walking the parsed trees
+    of the source and of every box it reaches through v() and a().
+
+    A reference whose target is computed at run time (v(w(a|b)), o(v(x)))
+    can't be followed, so it marks the canvas as dynamic and every wildcard
+    and text file counts as a dependency.
+    """
+
+    def __init__(self, canvas):
+        self.box_map = {k.lower(): v for k, v in canvas["box_map"].items()}
+        self.area_boxes = canvas["area_boxes"]
+        self.list_keys = set()
+        self.textfiles = set()
+        self.uses_loras = False
+        self.uses_embeddings = False
+        self.dynamic = False
+        self._walked = set()
+
+    def walk_text(self, text):
+        if text in self._walked:
+            return
+        self._walked.add(text)
+        self._walk(_TREE_BUILDER._get_tree(text))
+
+    def _walk(self, node):
+        if isinstance(node, CompositeNode):
+            for child in node.children:
+                self._walk(child)
+        elif isinstance(node, CommandNode):
+            self._command(node.command_name, node.arguments)
+            for argument in node.arguments:
+                self._walk(argument)
+
+    def _command(self, name, arguments):
+        spec = REGISTRY.get(name)
+        if spec is None:
+            self.dynamic = True
+            return
+        dependencies = spec.dependencies_for(len(arguments))
+        if not spec.builtin:
+            # There's no telling which boxes or files a custom command reads.
+            if dependencies & _FOLLOWED_DEPENDENCIES:
+                self.dynamic = True
+            return
+        if name == "v":
+            # v(name|value) only sets a variable.
+            if "canvas" in dependencies:
+                self._box_references(arguments[0])
+        elif name == "a":
+            self._area_reference(arguments[0])
+        elif name in ("w", "i"):
+            self._list_references(name, arguments)
+        elif name == "o":
+            text = static_text(arguments[0]) if arguments else ""
+            if text is None:
+                self.dynamic = True
+            elif text.strip():
+                filename = text.strip()
+                if not filename.endswith(".txt"):
+                    filename += ".txt"
+                self.textfiles.add(os.path.basename(filename))
+        elif name == "lora":
+            self.uses_loras = True
+        elif name == "embed":
+            self.uses_embeddings = True
+
+    def _list_references(self, name, arguments):
+        for argument in arguments:
+            text = static_text(argument)
+            if text is None:
+                self.dynamic = True
+                continue
+            options = _expand_options(text) if name == "i" else (text,)
+            for option in options:
+                self.list_keys.add(parse_weighted_option(option)[0].strip().lower())
+
+    def _box_references(self, argument):
+        text = static_text(argument)
+        if text is None:
+            self.dynamic = True
+            return
+        for _, var_name in _VAR_TOKENS.findall(text):
+            title = var_name.strip().lower()
+            if title in self.box_map:
+                self.walk_text(self.box_map[title])
+
+    def _area_reference(self, argument):
+        text = static_text(argument)
+        if text is None:
+            self.dynamic = True
+            return
+        title = text.strip().lower()
+        if title in self.area_boxes:
+            self.walk_text(self.area_boxes[title].get("content", ""))
+
+
+def canvas_fingerprint(canvas, wildcards, textfiles_directory):
+    """
+    Hash of the versions of the wildcard, text, LoRA and embedding files a
+    run of `canvas` (as returned by ThoughtBubbleNode._read_canvas) can read.
+    ComfyUI compares the node's inputs itself, so the canvas text, controls
+    and seed are not part of it.
+    """
+    deps = _Dependencies(canvas)
+    deps.walk_text(canvas["source"])
+
+    if deps.dynamic:
+        wildcard_names = sorted(wildcards)
+        try:
+            textfiles = sorted(
+                f for f in os.listdir(textfiles_directory) if f.endswith(".txt")
+            )
+        except OSError:
+            textfiles = []
+    else:
+        wildcard_names = sorted(key for key in deps.list_keys if key in wildcards)
+        textfiles = sorted(deps.textfiles)
+
+    file_versions = getattr(wildcards, "file_version", None)
+    dependencies = {
+        "wildcards": {
+            name: file_versions(name) if file_versions is not None else None
+            for name in wildcard_names
+        },
+        "textfiles": {
+            name: file_version(os.path.join(textfiles_directory, name))
+            for name in textfiles
+        },
+        "loras": get_name_index("loras").names if deps.uses_loras else None,
+        "embeddings": (
+            get_name_index("embeddings", fold_case=True).names
+            if deps.uses_embeddings
+            else None
+        ),
+    }
+    payload = json.dumps(dependencies, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
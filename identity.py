@@ -0,0 +1,53 @@
+# filename: thoughtbubble/identity.py
+
+import itertools
+import threading
+import weakref
+
+# id(obj) -> (weak reference, token). A token is never handed out twice, so a
+# key built from it can't match a different object that later reuses the id.
+_TOKENS = {}
+# Re-entrant: a weakref callback can run from garbage collection triggered
+# while the lock is held.
+_TOKENS_LOCK = threading.RLock()
+_NEXT_TOKEN = itertools.count(1)
+
+
+def _forget(obj_id, ref):
+    with _TOKENS_LOCK:
+        entry = _TOKENS.get(obj_id)
+        if entry is not None and entry[0] is ref:
+            del _TOKENS[obj_id]
+
+
+def object_token(obj):
+    """
+    Returns an integer that identifies `obj` for as long as it is alive and is
+    never reused afterwards, or None if `obj` can't be weakly referenced (such
+    objects must not be cached on).
+    """
+    obj_id = id(obj)
+    with _TOKENS_LOCK:
+        entry = _TOKENS.get(obj_id)
+        if entry is not None and entry[0]() is obj:
+            return entry[1]
+        try:
+            ref = weakref.ref(obj, lambda ref, obj_id=obj_id: _forget(obj_id, ref))
+        except TypeError:
+            return None
+        token = next(_NEXT_TOKEN)
+        _TOKENS[obj_id] = (ref, token)
+        return token
+
+
+def patcher_identity(obj):
+    """
+    Cache key part for a model or CLIP: its object token plus the patches_uuid
+    of its ModelPatcher, which ComfyUI replaces whenever the patches change.
+    None if the object can't be identified safely.
+    """
+    token = object_token(obj)
+    if token is None:
+        return None
+    patcher = getattr(obj, "patcher", obj)
+    return (token, getattr(patcher, "patches_uuid", None))
@@ -330,7 +330,7 @@ export class TextBox extends BaseBox {
         const variablesByBoxId = new Map();
 
         app.graph._nodes.forEach(node => {
-            if (node.type === "ThoughtBubbleNode") {
+            if (node.type === "ThoughtBubbleNode" || node.type === "ThoughtBubbleBatchNode") {
                 node.stateManager.state.boxes.forEach(box => {
                     if (box.type === 'controls' && box.variables && box.variables.length > 0) {
                         if (!variablesByBoxId.has(box.id)) {
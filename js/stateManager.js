@@ -31,6 +31,8 @@ export class StateManager {
             iterator: 0,
             theme: {},
             periodIsBreak: true,
+            lazyBranches: false,
+            rngStreams: false,
             showMinimap: false,
         };
         try {
@@ -10,6 +10,88 @@ import { ControlsBox } from "./box-types/controlsBox.js";
 import { ThemeManager } from "./themeManager.js";
 import { ListBox } from "./box-types/listBox.js";
 
+const THOUGHT_BUBBLE_CLASSES = new Set(["ThoughtBubbleNode", "ThoughtBubbleBatchNode"]);
+
+// A batch run consumes batch_size * iterator_step iterator values.
+function iteratorStride(node) {
+    if (node.type !== "ThoughtBubbleBatchNode") return 1;
+    const value = name => node.widgets?.find(w => w.name === name)?.value ?? 1;
+    return Math.max(1, value("batch_size") * value("iterator_step"));
+}
+
+// Canvas and box fields that only change how the canvas looks. They are left
+// out of the prompt, so panning or moving boxes doesn't make ComfyUI re-run
+// the node; the workflow still saves them.
+const VIEW_KEYS = ["pan", "zoom", "gridSize", "showGrid", "savedView", "theme", "showMinimap"];
+const BOX_VIEW_KEYS = ["x", "y", "width", "height", "old", "verticalSplit"];
+
+// Spellings of the commands that read the run counter, including ones other
+// extensions registered. Until the backend has sent them, the counter is
+// always kept.
+let iteratorAliases = null;
+
+async function loadIteratorAliases() {
+    try {
+        const response = await fetch('/thoughtbubble/iterator_commands');
+        if (response.ok) iteratorAliases = await response.json();
+    } catch (e) { console.error("Could not load ThoughtBubble iterator commands", e); }
+}
+
+function readsIterator(boxes) {
+    if (!iteratorAliases) return true;
+    const calls = iteratorAliases.map(alias => alias + "(");
+    return boxes.some(box => {
+        const content = String(box.content ?? "");
+        return calls.some(call => content.includes(call));
+    });
+}
+
+// The backend only cares about box order when titles repeat, several boxes
+// are maximized or there is more than one controls box.
+function boxOrderMatters(boxes) {
+    const titles = new Set();
+    let maximized = 0, controls = 0;
+    for (const box of boxes) {
+        const title = (box.title || "").trim().toLowerCase();
+        if (title) {
+            if (titles.has(title)) return true;
+            titles.add(title);
+        }
+        if (box.displayState === "maximized") maximized++;
+        if (box.type === "controls") controls++;
+    }
+    return maximized > 1 || controls > 1;
+}
+
+function promptCanvasData(value, keepIterator) {
+    let data;
+    try {
+        data = JSON.parse(value);
+    } catch (e) {
+        return value;
+    }
+    for (const key of VIEW_KEYS) delete data[key];
+    const boxes = (data.boxes || []).map(box => {
+        const copy = { ...box };
+        for (const key of BOX_VIEW_KEYS) delete copy[key];
+        // Only a maximized box changes what is evaluated.
+        if (copy.displayState !== "maximized") delete copy.displayState;
+        return copy;
+    });
+    // Bringing a box to the front reorders the list; sort it when that's safe.
+    if (!boxOrderMatters(boxes)) {
+        boxes.sort((a, b) => (String(a.id) < String(b.id) ? -1 : String(a.id) > String(b.id) ? 1 : 0));
+    }
+    data.boxes = boxes;
+    // The run counter advances on every queue but only a few commands read it.
+    // Commands only come from box text, so if none of them appears in any box
+    // it can be left out.
+    if (!keepIterator && !readsIterator(boxes)) {
+        data.iterator = 0;
+    }
+    return JSON.stringify(data);
+}
+
 app.registerExtension({
     name: "Comfy.Widget.ThoughtBubble",
 
@@ -18,6 +100,7 @@ app.registerExtension({
         boxTypeRegistry.set("area", AreaConditioningBox);
         boxTypeRegistry.set("controls", ControlsBox);
         boxTypeRegistry.set("list", ListBox);
+        loadIteratorAliases();
 
         const link = document.createElement("link");
         link.rel = "stylesheet";
@@ -30,13 +113,13 @@ app.registerExtension({
             const prompt = await originalGraphToPrompt.apply(this, arguments);
 
             const thoughtBubbleNodes = app.graph._nodes.filter(
-                node => node.type === "ThoughtBubbleNode" && node.mode !== 2 && node.mode !== 4
+                node => THOUGHT_BUBBLE_CLASSES.has(node.type) && node.mode !== 2 && node.mode !== 4
             );
 
             for (const node of thoughtBubbleNodes) {
                 if (node.stateManager && node.toolbar) {
                     const currentValue = node.stateManager.state.iterator || 0;
-                    const newValue = currentValue + 1;
+                    const newValue = currentValue + iteratorStride(node);
                     node.stateManager.state.iterator = newValue;
                     node.toolbar.iteratorDisplay.textContent = `Run: ${newValue}`;
                     node.stateManager.state.boxes.forEach(box => {
@@ -56,7 +139,7 @@ app.registerExtension({
     },
 
     async nodeCreated(node) {
-        if (node.comfyClass !== "ThoughtBubbleNode") return;
+        if (!THOUGHT_BUBBLE_CLASSES.has(node.comfyClass)) return;
 
         try {
             const response = await fetch('/thoughtbubble/themes/default/get');
@@ -72,6 +155,9 @@ app.registerExtension({
 
         const dataWidget = node.widgets.find(w => w.name === "canvas_data");
         dataWidget.hidden = true;
+        // The batch node outputs the iterator values, so it always needs them.
+        dataWidget.serializeValue = () =>
+            promptCanvasData(dataWidget.value, node.comfyClass === "ThoughtBubbleBatchNode");
 
         dataWidget.computeSize = function (width) { return [width, 0]; }
 
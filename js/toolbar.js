@@ -24,11 +24,13 @@ export class Toolbar {
         const { gridLabel, gridSelect } = this._createGridSizeSelector();
         const toggleGridButton = this._createToggleGridButton();
         const togglePeriodBreakButton = this._createTogglePeriodBreakButton();
+        const toggleLazyBranchesButton = this._createToggleLazyBranchesButton();
+        const toggleRngStreamsButton = this._createToggleRngStreamsButton();
         const toggleMinimapButton = this._createToggleMinimapButton(); // <-- NEW
 
         const iteratorControl = this._createIteratorControl();
 
-        this.toolbarEl.append(this.saveButton, this.loadButton, fitViewButton, themeButton, togglePeriodBreakButton, toggleMinimapButton, gridLabel, gridSelect, toggleGridButton, iteratorControl); // <-- NEW
+        this.toolbarEl.append(this.saveButton, this.loadButton, fitViewButton, themeButton, togglePeriodBreakButton, toggleLazyBranchesButton, toggleRngStreamsButton, toggleMinimapButton, gridLabel, gridSelect, toggleGridButton, iteratorControl); // <-- NEW
     }
 
     handleTheme() {
@@ -107,6 +109,28 @@ export class Toolbar {
         return button;
     }
 
+    _createToggleLazyBranchesButton() {
+        const label = () => this.stateManager.state.lazyBranches ? "Branches = Lazy" : "Branches = Eager";
+        const button = this._createButton(label(), () => {
+            this.stateManager.state.lazyBranches = !this.stateManager.state.lazyBranches;
+            button.textContent = label();
+            this.stateManager.save();
+        });
+        button.title = "Lazy: w() and i() only run the option they pick (changes seeded results)";
+        return button;
+    }
+
+    _createToggleRngStreamsButton() {
+        const label = () => this.stateManager.state.rngStreams ? "Random = Per Command" : "Random = Shared";
+        const button = this._createButton(label(), () => {
+            this.stateManager.state.rngStreams = !this.stateManager.state.rngStreams;
+            button.textContent = label();
+            this.stateManager.save();
+        });
+        button.title = "Per command: each w() and r() draws from its own random stream, so its pick doesn't depend on what ran before it (changes seeded results)";
+        return button;
+    }
+
     // --- NEW: Add toggle button for minimap ---
     _createToggleMinimapButton() {
         const button = this._createButton(
@@ -0,0 +1,317 @@
+# filename: thoughtbubble/loras.py
+
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import comfy.lora
+import comfy.utils
+from .caches import LRUCache
+from .identity import object_token, patcher_identity
+
+try:
+    import comfy.lora_convert as _lora_convert
+except ImportError:
+    _lora_convert = None
+
+
+def state_dict_nbytes(state_dict):
+    return sum(
+        tensor.element_size() * tensor.nelement()
+        for tensor in state_dict.values()
+        if hasattr(tensor, "element_size")
+    )
+
+
+# Process-wide cache of loaded LoRA files, keyed by (path, mtime_ns, size) so
+# an edited file is never served from memory. The budget can be set with the
+# THOUGHTBUBBLE_LORA_CACHE_MB environment variable.
+LORA_CACHE = LRUCache(
+    max_bytes=int(os.environ.get("THOUGHTBUBBLE_LORA_CACHE_MB", "2048")) * 1024 * 1024,
+    sizeof=state_dict_nbytes,
+)
+# path -> key of the version currently held in LORA_CACHE.
+_CACHED_VERSIONS = {}
+_VERSIONS_LOCK = threading.Lock()
+
+
+def file_version(path):
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+# Background loads started by prefetch_lora(): cache key -> Future.
+_PREFETCH_POOL = ThreadPoolExecutor(
+    max_workers=4, thread_name_prefix="ThoughtBubbleLoRA"
+)
+_PENDING = {}
+_PENDING_LOCK = threading.Lock()
+
+
+def _load_uncached(path, key):
+    # load_torch_file maps safetensors files through the safetensors library.
+    lora = comfy.utils.load_torch_file(path, safe_load=True)
+    with _VERSIONS_LOCK:
+        previous = _CACHED_VERSIONS.get(path)
+        if previous is not None and previous != key:
+            LORA_CACHE.discard(previous)
+        _CACHED_VERSIONS[path] = key
+    LORA_CACHE.put(key, lora)
+    return lora
+
+
+def prefetch_lora(path):
+    """Starts loading a LoRA file on the prefetch pool unless it is cached."""
+    key = (path,) + file_version(path)
+    if key in LORA_CACHE:
+        return
+    with _PENDING_LOCK:
+        if key in _PENDING:
+            return
+        future = _PREFETCH_POOL.submit(_load_uncached, path, key)
+        _PENDING[key] = future
+    future.add_done_callback(lambda _: _forget_pending(key))
+
+
+def _forget_pending(key):
+    with _PENDING_LOCK:
+        _PENDING.pop(key, None)
+
+
+def load_lora(path):
+    """
+    Returns the state dict of a LoRA file, from LORA_CACHE when the file is
+    unchanged, waiting for a prefetch of it if one is running. The dict is
+    shared between callers and must not be modified.
+    """
+    key = (path,) + file_version(path)
+    lora = LORA_CACHE.get(key)
+    if lora is not None:
+        return lora
+    with _PENDING_LOCK:
+        future = _PENDING.get(key)
+    if future is not None:
+        try:
+            return future.result()
+        except Exception as e:
+            print(f"Thought Bubble Warning: Prefetch of '{path}' failed, retrying: {e}")
+    return _load_uncached(path, key)
+
+
+def _patch_key(key):
+    return key if isinstance(key, str) else key[0]
+
+
+class _AppliedLora:
+    __slots__ = (
+        "path",
+        "version",
+        "model_strength",
+        "clip_strength",
+        "patches",
+        "model_keys",
+        "clip_keys",
+    )
+
+    def __init__(self, path, version, model_strength, clip_strength):
+        self.path = path
+        self.version = version
+        self.model_strength = model_strength
+        self.clip_strength = clip_strength
+        # Loaded patches and the keys each patcher accepted; None if the
+        # LoRA could not be applied.
+        self.patches = None
+        self.model_keys = ()
+        self.clip_keys = ()
+
+
+class LoraPatchStack:
+    """
+    The LoRA-patched model/clip of one node, updated incrementally.
+
+    Each run's LoRA list is diffed against the previous one. Removed LoRAs
+    have their patch entries taken out, re-weighted ones get their strength
+    replaced in place and new ones are appended, all on a clone of the last
+    patched model/clip. A run only falls back to re-patching from the base
+    model when that would leave the patches in a different order than a
+    rebuild, or when the base model/clip (or its patches) changed.
+    """
+
+    def __init__(self):
+        # Identities of the base model/clip; the objects themselves aren't
+        # kept alive by the stack.
+        self.base_identity = None
+        self.model = None
+        self.clip = None
+        self.applied = []
+        self._key_map = None
+        self._key_map_owner = None
+        self.counters = {"rebuilds": 0, "added": 0, "removed": 0, "reweighted": 0}
+
+    def apply(self, model, clip, loras):
+        """
+        Returns (model, clip) with `loras` applied, a list of
+        (path, model_strength, clip_strength) in application order.
+        """
+        if not loras:
+            return model, clip
+
+        wanted = []
+        for path, model_strength, clip_strength in loras:
+            try:
+                version = file_version(path)
+            except OSError:
+                version = None
+            wanted.append(_AppliedLora(path, version, model_strength, clip_strength))
+
+        base_identity = self._identity(model, clip)
+        if base_identity is None or base_identity != self.base_identity:
+            return self._rebuild(model, clip, wanted)
+        plan = self._plan(wanted)
+        if plan is None:
+            return self._rebuild(model, clip, wanted)
+
+        removed, reweighted, added = plan
+        if not (removed or reweighted or added):
+            return self.model, self.clip
+
+        model_out, clip_out = self.model.clone(), self.clip.clone()
+        for entry in removed:
+            self._remove(model_out, clip_out, entry)
+        for entry, model_strength, clip_strength in reweighted:
+            self._reweight(model_out, clip_out, entry, model_strength, clip_strength)
+        for entry in added:
+            self._add(model_out, clip_out, entry)
+        for patcher in (model_out, clip_out.patcher):
+            patcher.patches_uuid = uuid.uuid4()
+
+        kept = [entry for entry in self.applied if entry not in removed]
+        self.applied = kept + [entry for entry in added if entry.patches is not None]
+        self.model, self.clip = model_out, clip_out
+        self.counters["removed"] += len(removed)
+        self.counters["reweighted"] += len(reweighted)
+        self.counters["added"] += len(added)
+        return model_out, clip_out
+
+    def _plan(self, wanted):
+        """
+        Returns (removed, reweighted, added), or None when an incremental
+        update can't reproduce the order a full rebuild would give.
+        """
+        def identities(entries):
+            seen, result = {}, []
+            for entry in entries:
+                base = (entry.path, entry.version)
+                seen[base] = seen.get(base, 0) + 1
+                result.append(base + (seen[base],))
+            return result
+
+        old_ids = identities(self.applied)
+        new_ids = identities(wanted)
+        old_by_id = dict(zip(old_ids, self.applied))
+        new_set, old_set = set(new_ids), set(old_ids)
+
+        kept = [identity for identity in new_ids if identity in old_set]
+        # Kept LoRAs must stay in the same order and come before new ones.
+        if [identity for identity in old_ids if identity in new_set] != kept:
+            return None
+        if new_ids[: len(kept)] != kept:
+            return None
+
+        removed = [
+            old_by_id[identity] for identity in old_ids if identity not in new_set
+        ]
+        reweighted = []
+        for identity, entry in zip(new_ids, wanted):
+            old = old_by_id.get(identity)
+            if old is not None and (
+                old.model_strength != entry.model_strength
+                or old.clip_strength != entry.clip_strength
+            ):
+                reweighted.append((old, entry.model_strength, entry.clip_strength))
+        added = wanted[len(kept) :]
+        return removed, reweighted, added
+
+    @staticmethod
+    def _identity(model, clip):
+        model_identity = patcher_identity(model)
+        clip_identity = patcher_identity(clip)
+        if model_identity is None or clip_identity is None:
+            return None
+        return (model_identity, clip_identity)
+
+    def _rebuild(self, model, clip, wanted):
+        model_out, clip_out = model.clone(), clip.clone()
+        for entry in wanted:
+            self._add(model_out, clip_out, entry)
+        self.base_identity = self._identity(model, clip)
+        self.model, self.clip = model_out, clip_out
+        # LoRAs that failed are left out, so the next run tries them again.
+        self.applied = [entry for entry in wanted if entry.patches is not None]
+        self.counters["rebuilds"] += 1
+        return model_out, clip_out
+
+    def _key_map_for(self, model, clip):
+        # The key map only depends on the wrapped modules, which clones share.
+        owner = (object_token(model.model), object_token(clip.cond_stage_model))
+        if self._key_map is None or None in owner or owner != self._key_map_owner:
+            key_map = comfy.lora.model_lora_keys_unet(model.model, {})
+            self._key_map = comfy.lora.model_lora_keys_clip(
+                clip.cond_stage_model, key_map
+            )
+            self._key_map_owner = owner
+        return self._key_map
+
+    def _load_patches(self, model, clip, path):
+        # Same steps as comfy.sd.load_lora_for_models, minus the clones.
+        lora = load_lora(path)
+        if _lora_convert is not None:
+            lora = _lora_convert.convert_lora(lora)
+        return comfy.lora.load_lora(lora, self._key_map_for(model, clip))
+
+    def _add(self, model, clip, entry):
+        try:
+            entry.patches = self._load_patches(model, clip, entry.path)
+            entry.model_keys = model.add_patches(entry.patches, entry.model_strength)
+            entry.clip_keys = clip.add_patches(entry.patches, entry.clip_strength)
+        except Exception as e:
+            if entry.patches is not None:
+                # Take back whatever was added before the failure.
+                self._remove(model, clip, entry)
+            entry.patches = None
+            entry.model_keys = entry.clip_keys = ()
+            filename = os.path.basename(entry.path)
+            print(f"Thought Bubble Warning: Could not apply LoRA '{filename}': {e}")
+
+    @staticmethod
+    def _remove(model, clip, entry):
+        for patcher, keys in (
+            (model, entry.model_keys),
+            (clip.patcher, entry.clip_keys),
+        ):
+            for key in keys:
+                name = _patch_key(key)
+                value = entry.patches[key]
+                remaining = [
+                    p for p in patcher.patches.get(name, []) if p[1] is not value
+                ]
+                if remaining:
+                    patcher.patches[name] = remaining
+                else:
+                    patcher.patches.pop(name, None)
+
+    @staticmethod
+    def _reweight(model, clip, entry, model_strength, clip_strength):
+        for patcher, keys, strength in (
+            (model, entry.model_keys, model_strength),
+            (clip.patcher, entry.clip_keys, clip_strength),
+        ):
+            for key in keys:
+                name = _patch_key(key)
+                value = entry.patches[key]
+                patcher.patches[name] = [
+                    (strength,) + p[1:] if p[1] is value else p
+                    for p in patcher.patches[name]
+                ]
+        entry.model_strength = model_strength
+        entry.clip_strength = clip_strength
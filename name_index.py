@@ -0,0 +1,139 @@
+# filename: thoughtbubble/name_index.py
+
+import os
+import threading
+from bisect import bisect_left
+import folder_paths
+
+_MAX_CHAR = "\U0010ffff"
+
+
+class NameIndex:
+    """
+    Sorted view of a model folder's file list for prefix and exact lookups.
+
+    Lookups return the same name as the first match of a linear scan over
+    the original list (list order, not sort order), in O(log n).
+    With `fold_case`, names and queries are compared lowercased.
+    """
+
+    def __init__(self, names, fold_case=False):
+        self.names = list(names)
+        self.fold_case = fold_case
+        self._order = sorted(
+            range(len(self.names)), key=lambda i: (self._key(self.names[i]), i)
+        )
+        self._keys = [self._key(self.names[i]) for i in self._order]
+        # When sorting didn't reorder anything, the first key in any range is
+        # also the earliest in list order; otherwise ranges go through a
+        # sparse table of minimum positions.
+        self._in_list_order = all(
+            a < b for a, b in zip(self._order, self._order[1:])
+        )
+        self._sparse = None
+
+    def _key(self, name):
+        return name.lower() if self.fold_case else name
+
+    def __len__(self):
+        return len(self.names)
+
+    def find_exact(self, name):
+        key = self._key(name)
+        lo = bisect_left(self._keys, key)
+        if lo < len(self._keys) and self._keys[lo] == key:
+            # Equal keys are sorted by list position.
+            return self.names[self._order[lo]]
+        return None
+
+    def find_prefix(self, prefix):
+        key = self._key(prefix)
+        keys = self._keys
+        lo = bisect_left(keys, key)
+        hi = bisect_left(keys, key + _MAX_CHAR, lo)
+        while hi < len(keys) and keys[hi].startswith(key):
+            hi += 1
+        if lo == hi:
+            return None
+        return self.names[self._first_position(lo, hi)]
+
+    def _first_position(self, lo, hi):
+        if self._in_list_order:
+            return self._order[lo]
+        if self._sparse is None:
+            levels = [self._order]
+            width = 1
+            while width * 2 <= len(self._order):
+                previous = levels[-1]
+                levels.append(
+                    [
+                        min(previous[i], previous[i + width])
+                        for i in range(len(previous) - width)
+                    ]
+                )
+                width *= 2
+            self._sparse = levels
+        level = (hi - lo).bit_length() - 1
+        row = self._sparse[level]
+        return min(row[lo], row[hi - (1 << level)])
+
+
+class _FolderIndex:
+    """NameIndex for one folder_paths kind, rebuilt when a directory changes."""
+
+    def __init__(self, kind, fold_case):
+        self.kind = kind
+        self.fold_case = fold_case
+        self.index = None
+        self._directories = None
+        self._lock = threading.Lock()
+
+    def _snapshot(self):
+        """(root list, {directory: mtime_ns}) for every folder under the roots."""
+        roots = tuple(folder_paths.get_folder_paths(self.kind))
+        mtimes = {}
+        for root in roots:
+            for directory, _, _ in os.walk(root, followlinks=True):
+                try:
+                    mtimes[directory] = os.stat(directory).st_mtime_ns
+                except OSError:
+                    pass
+        return roots, mtimes
+
+    def _is_current(self):
+        roots, mtimes = self._directories
+        if tuple(folder_paths.get_folder_paths(self.kind)) != roots:
+            return False
+        for directory, mtime in mtimes.items():
+            try:
+                if os.stat(directory).st_mtime_ns != mtime:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def get(self):
+        with self._lock:
+            if self.index is None or not self._is_current():
+                self._directories = self._snapshot()
+                try:
+                    names = folder_paths.get_filename_list(self.kind)
+                except Exception as e:
+                    print(f"Thought Bubble Error listing {self.kind}: {e}")
+                    names = []
+                self.index = NameIndex(names, fold_case=self.fold_case)
+            return self.index
+
+
+_INDEXES = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+def get_name_index(kind, fold_case=False):
+    """Process-wide NameIndex for a folder_paths kind such as "loras"."""
+    with _INDEXES_LOCK:
+        folder_index = _INDEXES.get((kind, fold_case))
+        if folder_index is None:
+            folder_index = _FolderIndex(kind, fold_case)
+            _INDEXES[(kind, fold_case)] = folder_index
+    return folder_index.get()
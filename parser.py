@@ -1,7 +1,15 @@
 # filename: thoughtbubble/parser.py
 
+import random
 import re
-from . import commands
+from .caches import LRUCache
+from .commands.registry import ALL_DEPENDENCIES, NO_DEPENDENCIES, REGISTRY
+from .context import as_context
+from .rng import RNGStreams, stable_key
+
+
+class BoxReferenceError(Exception):
+    """v() box references that loop forever or nest deeper than allowed."""
 
 
 class Node:
@@ -18,16 +26,27 @@ class TextNode(Node):
 
 
 class CompositeNode(Node):
+    # For box trees: whether the result only depends on the canvas, the
+    # iterator and the variables. Set on first use by CanvasParser.evaluate_box.
+    pure = None
+    # For root trees: (handler table, CompiledNode) from compile_tree, set on
+    # first use by CanvasParser._compiled.
+    program = None
+
     def __init__(self, children=None):
         self.children = children or []
 
     def execute(self, parser, context=""):
+        context = as_context(context)
+        mark = context.mark()
         results = []
-        current_context = context or ""
-        for child in self.children:
-            child_result = child.execute(parser, context=current_context)
-            results.append(child_result)
-            current_context += child_result
+        try:
+            for child in self.children:
+                child_result = child.execute(parser, context=context)
+                results.append(child_result)
+                context.append(child_result)
+        finally:
+            context.truncate(mark)
         return "".join(results)
 
 
@@ -47,6 +66,241 @@ class CommandNode(Node):
         return f"{self.command_name}({args_str})"
 
 
+class CompiledNode(Node):
+    """
+    A node lowered by compile_tree. `execute` is an instance attribute holding
+    a closure, so calling it skips method binding, and the handler it calls
+    was looked up when the tree was compiled. `text` (literal text) and
+    `children` (composites) mirror the source node, since some commands
+    inspect their arguments before running them. Folded commands get no
+    `text`, so those commands still see a command there.
+    """
+
+    __slots__ = ("execute", "text", "children")
+
+
+def compile_tree(node, handlers, source=""):
+    """
+    Lowers a parsed tree to CompiledNodes that run against `handlers` (a
+    COMMAND_HANDLERS-style table). The result has no per-run state and can
+    be executed any number of times, by any parser using the same table.
+
+    With the registry's table, commands whose whole subtree has no declared
+    dependencies (see commands/registry.py) are run once here and replaced
+    by their result.
+
+    Commands that use the RNG get a node key from `source` (the text the
+    tree was parsed from) and their position in the tree. With rng_streams,
+    that key and the box being evaluated select their stream.
+    """
+    scope = stable_key(source)
+    return _compile(node, handlers, handlers is COMMAND_HANDLERS, scope, ())[0]
+
+
+def _compile(node, handlers, fold, scope, path):
+    """Returns (CompiledNode, dependencies, result if constant else None)."""
+    compiled = CompiledNode()
+    if isinstance(node, TextNode):
+        compiled.text = node.text
+        compiled.execute = _constant(node.text)
+        return compiled, NO_DEPENDENCIES, node.text
+
+    if isinstance(node, CompositeNode):
+        parts = [
+            _compile(child, handlers, fold, scope, path + (i,))
+            for i, child in enumerate(node.children)
+        ]
+        compiled.children = [child for child, _, _ in parts]
+        dependencies = NO_DEPENDENCIES.union(*[deps for _, deps, _ in parts])
+        constants = [constant for _, _, constant in parts]
+        if None not in constants:
+            text = "".join(constants)
+            compiled.execute = _constant(text)
+            return compiled, dependencies, text
+        compiled.execute = _compile_composite(compiled.children, constants)
+        return compiled, dependencies, None
+
+    if isinstance(node, CommandNode):
+        parts = [
+            _compile(argument, handlers, fold, scope, path + (i,))
+            for i, argument in enumerate(node.arguments)
+        ]
+        arguments = [argument for argument, _, _ in parts]
+        dependencies = command_dependencies(node).union(*[deps for _, deps, _ in parts])
+        handler = handlers.get(f"{node.command_name.upper()}_COMMAND")
+        if handler is not None:
+
+            def execute(parser, context=""):
+                return handler(parser, arguments, context=context)
+
+        else:
+            name = node.command_name
+
+            def execute(parser, context=""):
+                args_str = "|".join(
+                    [argument.execute(parser, context=context) for argument in arguments]
+                )
+                return f"{name}({args_str})"
+
+        spec = REGISTRY.get(node.command_name)
+        if spec is not None and spec.uses_rng:
+            execute = _with_stream(execute, stable_key(scope, path))
+        compiled.execute = execute
+        if fold and not dependencies:
+            try:
+                # Nothing in the subtree reads the parser.
+                result = execute(None, context="")
+            except Exception:
+                # Left to fail (and report) at run time, as before.
+                return compiled, dependencies, None
+            compiled.execute = _constant(result)
+            return compiled, dependencies, result
+        return compiled, dependencies, None
+
+    compiled.execute = node.execute
+    return compiled, ALL_DEPENDENCIES, None
+
+
+def _with_stream(run, node_key):
+    # With rng_streams, the command draws from its own stream while it runs
+    # (its arguments switch to theirs in turn). Compiled trees are shared by
+    # every box with the same text, so the box is added at run time.
+    def execute(parser, context=""):
+        streams = parser.streams
+        if streams is None:
+            return run(parser, context=context)
+        outer = parser.rng
+        stack = parser._box_stack
+        parser.rng = streams.stream(node_key, stack[-1][0] if stack else None)
+        try:
+            return run(parser, context=context)
+        finally:
+            parser.rng = outer
+
+    return execute
+
+
+def _constant(text):
+    def execute(parser, context=""):
+        return text
+
+    return execute
+
+
+def _compile_composite(children, constants):
+    # Same steps as CompositeNode.execute. The last child's result is not
+    # appended to the context: it would be truncated again right away.
+    *leading, last = [
+        (text, None if text is not None else child.execute)
+        for child, text in zip(children, constants)
+    ]
+    last_text, last_run = last
+    if not leading:
+
+        def execute(parser, context=""):
+            return last_run(parser, context=as_context(context))
+
+        return execute
+
+    def execute(parser, context=""):
+        context = as_context(context)
+        append = context.append
+        mark = context.mark()
+        results = []
+        try:
+            for text, run in leading:
+                if run is not None:
+                    text = run(parser, context=context)
+                results.append(text)
+                append(text)
+            results.append(
+                last_text if last_run is None else last_run(parser, context=context)
+            )
+        finally:
+            context.truncate(mark)
+        return "".join(results)
+
+    return execute
+
+
+# "<NAME>_COMMAND" -> handler, backed by the command registry. Handlers are
+# imported the first time they are looked up.
+COMMAND_HANDLERS = REGISTRY.handlers
+# Dependencies that make a result differ between two evaluations in the
+# same run, or that change the run itself.
+_IMPURE_DEPENDENCIES = frozenset(("rng", "context", "effects"))
+
+
+def command_dependencies(node):
+    """Declared dependencies of a CommandNode's command, ignoring its arguments."""
+    spec = REGISTRY.get(node.command_name)
+    if spec is None:
+        # Not a registered command; rendered back as text.
+        return NO_DEPENDENCIES
+    return spec.dependencies_for(len(node.arguments))
+
+
+def node_dependencies(node):
+    """Union of the dependencies of every command in the subtree."""
+    if isinstance(node, CommandNode):
+        return command_dependencies(node).union(
+            *[node_dependencies(argument) for argument in node.arguments]
+        )
+    if isinstance(node, CompositeNode):
+        return NO_DEPENDENCIES.union(*[node_dependencies(child) for child in node.children])
+    return NO_DEPENDENCIES
+
+
+def is_pure(node):
+    """True if executing `node` has no side effects and reads no RNG or context."""
+    return not node_dependencies(node) & _IMPURE_DEPENDENCIES
+
+
+# In-band markers left by commands in the resolved text: LoRA tags from
+# lora(), blocks from neg()/-() and h(), and !word toggles.
+_LORA_TAG = re.compile(r"###LORA:::(.*?)###", re.DOTALL)
+_SEGMENT_TOKEN = re.compile(
+    r"###(NEG|/NEG|HIDDEN_START|HIDDEN_END)###|!\s*([a-zA-Z0-9_]+)|!"
+)
+# Every '#' of a well-formed text belongs to one of these block markers.
+_MARKER_HASHES = 6
+
+
+def _tag_period_breaks(text):
+    """
+    Replaces every '.' with a BREAK tag except those between two digits, in
+    one pass. Matches the regex version, where "1.2.3" only protects the
+    first period because the match for it consumes the "2".
+    """
+    if "." not in text:
+        return text
+    pieces = text.split(".")
+    out = [pieces[0]]
+    protected = False
+    for k in range(len(pieces) - 1):
+        left, right = pieces[k], pieces[k + 1]
+        protected = (
+            left[-1:].isdecimal()
+            and right[:1].isdecimal()
+            and not (protected and len(left) == 1)
+        )
+        out.append("." if protected else " ###PERIOD_BREAK_TAG### ")
+        out.append(right)
+    return "".join(out)
+
+
+def _join_comma_parts(text):
+    """Collapses whitespace and drops empty comma-separated parts."""
+    return ", ".join(filter(None, [p.strip() for p in " ".join(text.split()).split(",")]))
+
+
+# Parsed trees keyed by fragment text. Trees are never mutated during
+# execution, so a tree can be shared by every parser and every queue.
+AST_CACHE = LRUCache(max_entries=512)
+# Registering a command can change how text parses.
+REGISTRY.add_listener(AST_CACHE.clear)
+
+
 class CanvasParser:
     def __init__(
         self,
@@ -60,6 +314,9 @@ class CanvasParser:
         command_links=None,
         textfile_cache=None,
         period_is_break=True,
+        lazy_branches=False,
+        max_box_depth=32,
+        rng_streams=False,
     ):
         self.box_map = {k.lower(): v for k, v in box_map.items()}
         self.wildcards = wildcard_data
@@ -69,73 +326,171 @@ class CanvasParser:
         self.variables = {}
         self.control_vars_by_id = control_vars_by_id or {}
         self.control_vars_by_name = control_vars_by_name or {}
+        self.command_links = command_links or {}
+        # filepath -> (version, content) for o(); the node passes a shared dict.
+        self.textfile_cache = textfile_cache if textfile_cache is not None else {}
         self.period_is_break = period_is_break
+        # Lazy mode: w()/i() only execute the branch they pick (see README).
+        self.lazy_branches = lazy_branches
+        # Longest chain of v() box references before evaluation gives up.
+        self.max_box_depth = max_box_depth
+        # Stream mode: each w()/r() draws from its own counter-based stream,
+        # keyed by the run seed and its place in the canvas (see README), so
+        # its result doesn't depend on the draws made before it. Otherwise
+        # all commands share `rng` in evaluation order.
+        self.rng_streams = rng_streams
+        # RNGStreams of the current run, or None in sequential mode.
+        self.streams = None
+        # title -> result of each pure box evaluated so far in this run.
+        # Cleared whenever a variable is set, since boxes may read variables.
+        self.box_results = {}
+        # (title, pure) of the boxes being evaluated, outermost first.
+        self._box_stack = []
+        self._box_tainted = False
         self.loras_to_load = []
         self.areas_to_apply = []
         self.scheduled_prompts = []
+        # Optional callable(name), told about each LoRA as soon as it is
+        # extracted so its file can start loading in the background.
+        self.on_lora = None
 
-        self.command_handlers = {
-            "A_COMMAND": commands.command_area.execute,
-            "EQ_COMMAND": commands.command_eq.execute,
-            "H_COMMAND": commands.command_h.execute,
-            "I_COMMAND": commands.command_i.execute,
-            "IF_COMMAND": commands.command_if.execute,
-            "LORA_COMMAND": commands.command_lora.execute,
-            "LRA_COMMAND": commands.command_lora.execute,
-            "EMBED_COMMAND": commands.command_embed.execute,
-            "MULTI_IF_COMMAND": commands.command_multi_if.execute,
-            "NEG_COMMAND": commands.command_neg.execute,
-            "O_COMMAND": commands.command_o.execute,
-            "R_COMMAND": commands.command_r.execute,
-            "T_COMMAND": commands.command_t.execute,
-            "V_COMMAND": commands.command_v.execute,
-            "W_COMMAND": commands.command_w.execute,
-        }
-
-        self.syntax_map = {
-            "a": "A_COMMAND",
-            "area": "A_COMMAND",
-            "eq": "EQ_COMMAND",
-            "=": "EQ_COMMAND",
-            "h": "H_COMMAND",
-            "i": "I_COMMAND",
-            "if": "IF_COMMAND",
-            "?": "IF_COMMAND",
-            "lora": "LORA_COMMAND",
-            "lra": "LORA_COMMAND",
-            "embed": "EMBED_COMMAND",
-            "multi_if": "MULTI_IF_COMMAND",
-            "??": "MULTI_IF_COMMAND",
-            "neg": "NEG_COMMAND",
-            "-": "NEG_COMMAND",
-            "o": "O_COMMAND",
-            "r": "R_COMMAND",
-            "t": "T_COMMAND",
-            "v": "V_COMMAND",
-            "w": "W_COMMAND",
-        }
-
-        sorted_keys = sorted(self.syntax_map.keys(), key=len, reverse=True)
-        escaped_keys = [re.escape(k) for k in sorted_keys]
-        cmd_pattern = "|".join([f"{k}\(" for k in escaped_keys])
-        self.token_pattern = re.compile(f"({cmd_pattern})|(\|)|(\))|(\()")
+        self.command_handlers = COMMAND_HANDLERS
 
-    def parse(self, text):
+    # The grammar is read from the registry on use: trees land in the shared
+    # AST_CACHE, so every parser must build them from the current commands.
+    @property
+    def syntax_map(self):
+        return REGISTRY.syntax_map
+
+    @property
+    def token_pattern(self):
+        return REGISTRY.token_pattern
+
+    def _reset(self):
         self.variables = {}
+        self.box_results = {}
+        self._box_stack = []
+        self._box_tainted = False
         self.loras_to_load = []
         self.areas_to_apply = []
         self.scheduled_prompts = []
+
+    def _start_streams(self):
+        # One 64-bit draw from the run's rng seeds every stream, so streams
+        # follow the seed like sequential draws do.
+        self.streams = (
+            RNGStreams(self.rng.getrandbits(64)) if self.rng_streams else None
+        )
+
+    def parse(self, text):
+        self._reset()
+        self._start_streams()
         return self.parse_fragment(text, is_root=True)
 
+    def iter_batch(self, text, pairs):
+        """
+        Evaluates `text` once per (seed, iterator) pair against a single tree.
+
+        Yields one result dict per pair. The parser is left in that pair's
+        state (rng, iterator, side outputs) until the next item is requested,
+        so callers can parse follow-up fragments such as area boxes exactly
+        as they would after a plain parse().
+        """
+        program = self._get_program(text)
+        for seed, iterator in pairs:
+            self._reset()
+            self.rng = random.Random(seed)
+            self.iterator = iterator
+            self._start_streams()
+            positive, negative = self._post_process(program.execute(self, context=""))
+            yield {
+                "seed": seed,
+                "iterator": iterator,
+                "positive": positive,
+                "negative": negative,
+                "loras": list(self.loras_to_load),
+                "areas": list(self.areas_to_apply),
+                "scheduled_prompts": list(self.scheduled_prompts),
+            }
+
+    def parse_batch(self, text, pairs):
+        """List form of iter_batch(); each result matches a fresh parse()."""
+        return list(self.iter_batch(text, pairs))
+
+    def evaluate_box(self, title, context=""):
+        """
+        Returns the evaluated content of box `title` (a box_map key). A box
+        whose tree and nested boxes are all pure is evaluated once per run.
+        """
+        result = self.box_results.get(title)
+        if result is not None:
+            return result
+
+        root = self._get_tree(self.box_map[title])
+        if root.pure is None:
+            root.pure = is_pure(root)
+
+        stack = self._box_stack
+        titles = [t for t, _ in stack]
+        if title in titles:
+            loop = stack[titles.index(title) :]
+            # A loop through pure boxes repeats exactly, forever. One through
+            # w() or ?() may end, so it only runs into the depth limit.
+            if root.pure and all(pure for _, pure in loop):
+                raise BoxReferenceError(
+                    "Boxes reference each other in a loop: "
+                    + " -> ".join([t for t, _ in loop] + [title])
+                )
+        if len(stack) >= self.max_box_depth:
+            raise BoxReferenceError(
+                f"Box references are nested more than {self.max_box_depth} "
+                f"levels deep, starting with: {' -> '.join(titles[:4])} -> ..."
+            )
+
+        outer_tainted = self._box_tainted
+        self._box_tainted = not root.pure
+        stack.append((title, root.pure))
+        try:
+            result = self._compiled(root, self.box_map[title]).execute(
+                self, context=context
+            )
+        finally:
+            stack.pop()
+            tainted = self._box_tainted
+            self._box_tainted = outer_tainted or tainted
+        if not tainted:
+            self.box_results[title] = result
+        return result
+
     def parse_fragment(self, text, is_root=False, context=""):
-        tokens = self._tokenize(text)
-        root_children, _ = self._build_tree(tokens, terminators=[])
-        root = CompositeNode(root_children)
-        resolved_text = root.execute(self, context=context)
+        resolved_text = self._get_program(text).execute(self, context=context)
         if is_root:
             return self._post_process(resolved_text)
         return resolved_text
 
+    def _get_tree(self, text):
+        root = AST_CACHE.get(text)
+        if root is None:
+            tokens = self._tokenize(text)
+            root_children, _, _ = self._build_tree(tokens, 0, terminators=())
+            root = CompositeNode(root_children)
+            AST_CACHE.put(text, root)
+        return root
+
+    def _get_program(self, text):
+        return self._compiled(self._get_tree(text), text)
+
+    def _compiled(self, root, text):
+        """The compiled form of the root tree of `text`, built once per tree."""
+        program = root.program
+        if program is None or program[0] is not self.command_handlers:
+            program = (
+                self.command_handlers,
+                compile_tree(root, self.command_handlers, source=text),
+            )
+            root.program = program
+        return program[1]
+
     def _tokenize(self, text):
         result = []
         last_pos = 0
@@ -148,18 +503,25 @@ class CanvasParser:
             result.append(text[last_pos:])
         return result
 
-    def _build_tree(self, token_stream, terminators):
+    def _build_tree(self, tokens, pos, terminators):
+        """
+        Builds the children of one level starting at tokens[pos].
+        Returns (children, reason, next_pos) so callers can resume from where
+        the nested level stopped instead of consuming the token list.
+        """
         children = []
         current_text_buffer = []
         paren_depth = 0
+        token_count = len(tokens)
 
         def flush_text():
             if current_text_buffer:
                 children.append(TextNode("".join(current_text_buffer)))
                 current_text_buffer.clear()
 
-        while token_stream:
-            token = token_stream.pop(0)
+        while pos < token_count:
+            token = tokens[pos]
+            pos += 1
 
             if token == "(":
                 paren_depth += 1
@@ -170,7 +532,7 @@ class CanvasParser:
                     current_text_buffer.append(token)
                 elif ")" in terminators:
                     flush_text()
-                    return children, "CLOSE_PAREN"
+                    return children, "CLOSE_PAREN", pos
                 else:
                     current_text_buffer.append(token)
             elif token == "|":
@@ -178,7 +540,7 @@ class CanvasParser:
                     current_text_buffer.append(token)
                 elif "|" in terminators:
                     flush_text()
-                    return children, "SEPARATOR"
+                    return children, "SEPARATOR", pos
                 else:
                     current_text_buffer.append(token)
             elif token.endswith("(") and len(token) > 1:
@@ -189,8 +551,8 @@ class CanvasParser:
 
                 arguments = []
                 while True:
-                    arg_children, reason = self._build_tree(
-                        token_stream, terminators=["|", ")"]
+                    arg_children, reason, pos = self._build_tree(
+                        tokens, pos, terminators=("|", ")")
                     )
                     arguments.append(CompositeNode(arg_children))
                     if reason == "CLOSE_PAREN":
@@ -203,32 +565,130 @@ class CanvasParser:
                 current_text_buffer.append(token)
 
         flush_text()
-        return children, None
+        return children, None, pos
 
-    def _post_process(self, text):
-        # --- START FIX: Extract Lazy-Loaded LoRAs ---
-        # We look for the special tokens created by command_lora.py
-        # Only tokens that 'survived' w/if selection will be present here.
-        def extract_and_load_loras(match):
+    def _extract_loras(self, text):
+        """Removes the LoRA tags from `text`, recording each valid one."""
+        # Only tags that survived w()/if() selection are still in the text.
+        if "###LORA:::" not in text:
+            return text
+
+        def extract(match):
             try:
                 # Format: ###LORA:::name:::model_strength:::clip_strength###
-                content = match.group(1)
-                parts = content.split(":::")
+                parts = match.group(1).split(":::")
                 if len(parts) == 3:
                     name, model_str, clip_str = parts
                     self.loras_to_load.append((name, float(model_str), float(clip_str)))
+                    if self.on_lora is not None:
+                        self.on_lora(name)
             except Exception:
                 pass
-            return ""  # Remove the tag from the final prompt
+            return ""
+
+        return _LORA_TAG.sub(extract, text)
+
+    @staticmethod
+    def _scan_segments(text):
+        """
+        Splits LoRA-free resolved text into typed segments in one pass:
+        ("text", s) for visible positive text, ("neg", s) for negative text,
+        ("toggle", s) for words a !word inside a negative moves to the
+        positive, and ("hidden", s) for h() content.
+
+        Returns None for text the segments can't describe exactly: nested,
+        crossing or unclosed blocks, a bare '!' inside a negative, or '#'
+        characters outside the markers. _post_process_legacy handles those.
+        """
+        segments = []
+        negative = None  # pieces of the open negative block
+        hidden = None  # pieces of the open hidden block
+        markers = 0
+        pos = 0
+        for match in _SEGMENT_TOKEN.finditer(text):
+            if match.start() > pos:
+                piece = text[pos : match.start()]
+                if negative is not None:
+                    negative.append(piece)
+                elif hidden is not None:
+                    hidden.append(piece)
+                else:
+                    segments.append(("text", piece))
+            pos = match.end()
+
+            marker, word = match.group(1), match.group(2)
+            if marker is not None:
+                markers += 1
+                if marker == "NEG":
+                    if negative is not None:
+                        return None
+                    negative = []
+                elif marker == "/NEG":
+                    if negative is None:
+                        return None
+                    segments.append(("neg", "".join(negative)))
+                    negative = None
+                elif marker == "HIDDEN_START":
+                    if hidden is not None or negative is not None:
+                        return None
+                    hidden = []
+                else:
+                    if hidden is None or negative is not None:
+                        return None
+                    segments.append(("hidden", "".join(hidden)))
+                    hidden = None
+            elif word is not None:
+                word = word.replace("_", " ")
+                # Inside a negative the word moves to the positive; anywhere
+                # else it becomes a negative of its own.
+                segments.append(("toggle" if negative is not None else "neg", word))
+            elif negative is not None:
+                return None
+            elif hidden is not None:
+                hidden.append("!")
+            else:
+                segments.append(("text", "!"))
 
-        text = re.sub(
-            r"###LORA:::(.*?)###",
-            extract_and_load_loras,
-            text,
-            flags=re.DOTALL,
-        )
-        # --- END FIX ---
+        if negative is not None or hidden is not None:
+            return None
+        if text.count("#") != _MARKER_HASHES * markers:
+            return None
+        if pos < len(text):
+            segments.append(("text", text[pos:]))
+        return segments
+
+    def _post_process(self, text):
+        text = self._extract_loras(text)
+        segments = self._scan_segments(text)
+        if segments is None:
+            return self._post_process_legacy(text)
+
+        positive_parts, negative_parts, toggled = [], [], []
+        for kind, value in segments:
+            if kind == "text":
+                positive_parts.append(value)
+            elif kind == "neg":
+                value = value.strip()
+                if value:
+                    negative_parts.append(value)
+            elif kind == "toggle":
+                toggled.append(value)
+
+        full_positive_text = "".join(positive_parts).strip() + " " + " ".join(toggled)
+        if self.period_is_break:
+            full_positive_text = _tag_period_breaks(full_positive_text)
+        positive_prompt = _join_comma_parts(full_positive_text)
+        if self.period_is_break:
+            positive_prompt = positive_prompt.replace(
+                "###PERIOD_BREAK_TAG###", " BREAK "
+            )
+        return positive_prompt, _join_comma_parts(" ".join(negative_parts))
 
+    def _post_process_legacy(self, text):
+        """
+        The original chain of regex passes over LoRA-free text. Slower, but
+        it defines the output for text _scan_segments turns down.
+        """
         positive_toggled_content = []
 
         def extract_and_remove_neg_toggles(match):
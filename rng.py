@@ -0,0 +1,88 @@
+# filename: thoughtbubble/rng.py
+
+import hashlib
+import random
+
+_MASK = 0xFFFFFFFFFFFFFFFF
+# SplitMix64 increment (2**64 / golden ratio).
+_GAMMA = 0x9E3779B97F4A7C15
+
+
+def _mix(x):
+    """SplitMix64 output function."""
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK
+    return x ^ (x >> 31)
+
+
+def stable_key(*parts):
+    """64-bit hash of ints and strings that is the same in every process."""
+    digest = hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+class CounterRNG(random.Random):
+    """
+    random.Random whose n-th 64-bit output is a pure function of (key, n):
+    SplitMix64 evaluated at counter n. Nothing but the key and the number of
+    draws made so far goes into a result, so two generators with the same key
+    always agree, whatever else happened in between.
+
+    random() uses one output and getrandbits(k) ceil(k / 64), so choices(),
+    uniform() and randint() work unchanged on top of them.
+    """
+
+    def __init__(self, key=0):
+        super().__init__(key)
+
+    def seed(self, a=None, version=2):
+        if a is None:
+            a = 0
+        if not isinstance(a, int):
+            a = stable_key(a)
+        self.key = a & _MASK
+        self.counter = 0
+        self.gauss_next = None
+
+    def _next(self):
+        self.counter += 1
+        return _mix((self.key + self.counter * _GAMMA) & _MASK)
+
+    def random(self):
+        return (self._next() >> 11) * (1.0 / 9007199254740992.0)
+
+    def getrandbits(self, k):
+        if k < 0:
+            raise ValueError("number of bits must be non-negative")
+        result, bits = 0, 0
+        while bits < k:
+            result |= self._next() << bits
+            bits += 64
+        return result & ((1 << k) - 1)
+
+    def getstate(self):
+        return (self.key, self.counter, self.gauss_next)
+
+    def setstate(self, state):
+        self.key, self.counter, self.gauss_next = state
+
+
+class RNGStreams:
+    """
+    The per-command generators of one run. The stream for a command is keyed
+    by the run seed, the command's node key (see parser.compile_tree) and the
+    title of the box it runs in (None outside boxes), and is created on the
+    command's first draw.
+    """
+
+    def __init__(self, seed):
+        self.seed = seed
+        self._streams = {}
+
+    def stream(self, node_key, box=None):
+        key = (node_key, box)
+        rng = self._streams.get(key)
+        if rng is None:
+            rng = CounterRNG(stable_key(self.seed, node_key, box))
+            self._streams[key] = rng
+        return rng
@@ -3,35 +3,32 @@
 import json
 import os
 import random
+from .conditioning import enable_disk_cache, get_conditioning
+from .fingerprint import canvas_fingerprint
+from .loras import LoraPatchStack, prefetch_lora
+from .name_index import get_name_index
 from .parser import CanvasParser
-import comfy.sd
-import comfy.utils
+from .wildcards import get_wildcard_store
 import folder_paths
 from server import PromptServer
 import torch
 
 
 class ThoughtBubbleNode:
-    WILDCARD_CACHE = {}
-    # LORA_CACHE removed to prevent memory leaks
+    WILDCARD_STORE = None
+    # LoRA files are cached (with a byte budget) in loras.LORA_CACHE
     TEXTFILE_DIRECTORY = None
     TEXTFILE_CACHE = {}
+    # Size of the on-disk conditioning cache in MB; 0 keeps it off.
+    DISK_CACHE_MB = int(os.environ.get("THOUGHTBUBBLE_DISK_CACHE_MB", "0"))
+    # Longest chain of v() box references a canvas may use.
+    MAX_BOX_DEPTH = int(os.environ.get("THOUGHTBUBBLE_MAX_BOX_DEPTH", "32"))
 
     def __init__(self):
-        # Instance-level cache for models and conditioning
-        self.cached_model = None
-        self.cached_clip = None
-        self.last_lora_config = None
-        self.last_input_model_id = None
-
-        self.cached_positive_cond = None
-        self.cached_negative_cond = None
-        self.last_positive_prompt = None
-        self.last_negative_prompt = None
-        self.last_clip_id = None
-
-        self.last_area_config = None
-        self.last_timed_config = None
+        # Instance-level patched model/clip, updated incrementally as the
+        # LoRA list changes; conditioning is cached process-wide in
+        # conditioning.CONDITIONING_CACHE.
+        self.lora_stack = LoraPatchStack()
 
     @classmethod
     def INPUT_TYPES(s):
@@ -84,149 +81,193 @@ class ThoughtBubbleNode:
     FUNCTION = "process_data"
     CATEGORY = "Workflow Efficiency"
 
-    def _load_wildcards(self):
-        if self.WILDCARD_CACHE:
-            return
+    @classmethod
+    def IS_CHANGED(cls, canvas_data, **kwargs):
+        # ComfyUI already compares the inputs (the web view drops pan, zoom
+        # and box positions from canvas_data); this adds the files they read.
         try:
-            wildcards_dir = os.path.join(
-                os.path.dirname(folder_paths.get_input_directory()), "user", "wildcards"
+            return canvas_fingerprint(
+                cls._read_canvas(canvas_data),
+                cls._load_wildcards(),
+                cls._load_textfile_directory(),
             )
+        except Exception as e:
+            print(f"Thought Bubble Error computing the canvas fingerprint: {e}")
+            return float("NaN")
+
+    @classmethod
+    def _load_wildcards(cls):
+        try:
+            user_dir = os.path.join(
+                os.path.dirname(folder_paths.get_input_directory()), "user"
+            )
+            wildcards_dir = os.path.join(user_dir, "wildcards")
             if not os.path.exists(wildcards_dir):
                 os.makedirs(wildcards_dir, exist_ok=True)
-            for filename in os.listdir(wildcards_dir):
-                if filename.endswith(".txt"):
-                    name = os.path.splitext(filename)[0].lower()
-                    with open(
-                        os.path.join(wildcards_dir, filename), "r", encoding="utf-8"
-                    ) as f:
-                        self.WILDCARD_CACHE[name] = [line.strip() for line in f]
+            # Files are memory-mapped on first use; this only lists the folder.
+            store = get_wildcard_store(
+                wildcards_dir, os.path.join(user_dir, "thoughtbubble_cache", "wildcards")
+            )
+            store.refresh()
+            ThoughtBubbleNode.WILDCARD_STORE = store
         except Exception as e:
             print(f"Thought Bubble Error loading wildcards: {e}")
+        store = ThoughtBubbleNode.WILDCARD_STORE
+        return store if store is not None else {}
+
+    @staticmethod
+    def _close_wildcards():
+        # Pairs with the refresh in _load_wildcards: nothing stays mapped
+        # between executions, so large wildcard files can be edited or
+        # replaced. Small ones are held in memory and revalidated on refresh.
+        store = ThoughtBubbleNode.WILDCARD_STORE
+        if store is not None:
+            store.close_mapped_files()
 
-    def process_data(self, seed, canvas_data, model=None, clip=None):
-        self._load_wildcards()
-
-        if self.TEXTFILE_DIRECTORY is None:
-            self.TEXTFILE_DIRECTORY = os.path.join(
+    @classmethod
+    def _load_textfile_directory(cls):
+        if cls.TEXTFILE_DIRECTORY is None:
+            cls.TEXTFILE_DIRECTORY = os.path.join(
                 os.path.dirname(folder_paths.get_input_directory()), "user", "textfiles"
             )
-            if not os.path.exists(self.TEXTFILE_DIRECTORY):
-                os.makedirs(self.TEXTFILE_DIRECTORY, exist_ok=True)
+            if not os.path.exists(cls.TEXTFILE_DIRECTORY):
+                os.makedirs(cls.TEXTFILE_DIRECTORY, exist_ok=True)
+        return cls.TEXTFILE_DIRECTORY
+
+    def _load_disk_cache(self):
+        if self.DISK_CACHE_MB <= 0:
+            return
+        try:
+            enable_disk_cache(
+                os.path.join(
+                    os.path.dirname(folder_paths.get_input_directory()),
+                    "user",
+                    "thoughtbubble_cache",
+                    "conditioning",
+                ),
+                self.DISK_CACHE_MB * 1024 * 1024,
+            )
+        except Exception as e:
+            print(f"Thought Bubble Error setting up the conditioning cache: {e}")
+
+    @staticmethod
+    def _read_canvas(canvas_data):
+        """Extracts everything the parser needs from the canvas JSON."""
+        data = json.loads(canvas_data)
+        canvas = {
+            "iterator": data.get("iterator", 0),
+            "period_is_break": data.get("periodIsBreak", True),
+            "lazy_branches": data.get("lazyBranches", False),
+            "rng_streams": data.get("rngStreams", False),
+            "box_map": {},
+            "area_boxes": {},
+            "source": "",
+            "command_links": {},
+            "control_vars_by_id": {},
+            "control_vars_by_name": {},
+        }
+        boxes = data.get("boxes", [])
+        output_box_content, maximized_box = None, None
+
+        for box in boxes:
+            if box.get("type") == "controls":
+                for var in box.get("variables", []):
+                    var_id, var_name, var_value = (
+                        var.get("id"),
+                        var.get("name"),
+                        var.get("value"),
+                    )
+                    if var_id:
+                        canvas["control_vars_by_id"][var_id] = var_value
+                    if var_name:
+                        canvas["control_vars_by_name"][var_name] = var_value
+
+        for box in boxes:
+            title = box.get("title", "").strip().lower()
+            if title:
+                canvas["box_map"][title] = box.get("content", "")
+                if box.get("type") == "area":
+                    canvas["area_boxes"][title] = box
+            if title == "output":
+                output_box_content = box.get("content", "")
+                canvas["command_links"] = box.get("commandLinks", {})
+            if box.get("displayState") == "maximized" and maximized_box is None:
+                maximized_box = box
+
+        if maximized_box:
+            canvas["source"] = maximized_box.get("content", "")
+            canvas["command_links"] = maximized_box.get("commandLinks", {})
+        elif output_box_content is not None:
+            canvas["source"] = output_box_content
+        return canvas
+
+    def _create_parser(self, canvas, seed):
+        rng = random.Random()
+        rng.seed(seed)
+        return CanvasParser(
+            canvas["box_map"],
+            self._load_wildcards(),
+            self._load_textfile_directory(),
+            rng,
+            canvas["iterator"],
+            canvas["control_vars_by_id"],
+            canvas["control_vars_by_name"],
+            canvas["command_links"],
+            self.TEXTFILE_CACHE,
+            period_is_break=canvas["period_is_break"],
+            lazy_branches=canvas["lazy_branches"],
+            max_box_depth=self.MAX_BOX_DEPTH,
+            rng_streams=canvas["rng_streams"],
+        )
 
-        box_map, area_boxes = {}, {}
-        raw_prompt_source, command_links = "", {}
+    @staticmethod
+    def _area_config(parser, area_boxes):
+        """Parses the area boxes requested by a(); run it right after the main parse."""
+        config_list = []
+        for title in sorted(parser.areas_to_apply):
+            if title in area_boxes:
+                area_box = area_boxes[title]
+                area_prompt, _ = parser.parse(area_box.get("content", ""))
+                if area_prompt:
+                    config_list.append(
+                        (
+                            area_prompt,
+                            area_box.get("imageWidth", 512),
+                            area_box.get("imageHeight", 512),
+                            area_box.get("areaX", 0),
+                            area_box.get("areaY", 0),
+                            area_box.get("areaWidth", 64),
+                            area_box.get("areaHeight", 64),
+                            area_box.get("strength", 1.0),
+                        )
+                    )
+        return tuple(config_list)
+
+    def process_data(self, seed, canvas_data, model=None, clip=None):
         positive_prompt, negative_prompt = "", ""
         positive_conditioning, negative_conditioning = [], []
         model_out, clip_out = model, clip
 
-        all_control_vars_by_id = {}
-        all_control_vars_by_name = {}
-
         try:
-            data = json.loads(canvas_data)
-            iterator = data.get("iterator", 0)
-            period_is_break = data.get("periodIsBreak", True)
-            boxes = data.get("boxes", [])
-            output_box_content, maximized_box = None, None
-
-            for box in boxes:
-                if box.get("type") == "controls":
-                    for var in box.get("variables", []):
-                        var_id, var_name, var_value = (
-                            var.get("id"),
-                            var.get("name"),
-                            var.get("value"),
-                        )
-                        if var_id:
-                            all_control_vars_by_id[var_id] = var_value
-                        if var_name:
-                            all_control_vars_by_name[var_name] = var_value
-
-            for box in boxes:
-                title = box.get("title", "").strip().lower()
-                if title:
-                    box_map[title] = box.get("content", "")
-                    if box.get("type") == "area":
-                        area_boxes[title] = box
-                if title == "output":
-                    output_box_content = box.get("content", "")
-                    command_links = box.get("commandLinks", {})
-                if box.get("displayState") == "maximized" and maximized_box is None:
-                    maximized_box = box
-
-            if maximized_box:
-                raw_prompt_source = maximized_box.get("content", "")
-                command_links = maximized_box.get("commandLinks", {})
-            elif output_box_content is not None:
-                raw_prompt_source = output_box_content
+            canvas = self._read_canvas(canvas_data)
+            area_boxes = canvas["area_boxes"]
+            raw_prompt_source = canvas["source"]
 
             if raw_prompt_source:
-                rng = random.Random()
-                rng.seed(seed)
-                parser = CanvasParser(
-                    box_map,
-                    self.WILDCARD_CACHE,
-                    self.TEXTFILE_DIRECTORY,
-                    rng,
-                    iterator,
-                    all_control_vars_by_id,
-                    all_control_vars_by_name,
-                    command_links,
-                    self.TEXTFILE_CACHE,
-                    period_is_break=period_is_break,
-                )
+                parser = self._create_parser(canvas, seed)
+                if model is not None and clip is not None:
+                    parser.on_lora = self._prefetch_lora
                 positive_prompt, negative_prompt = parser.parse(raw_prompt_source)
 
                 if model is not None and clip is not None:
-                    loras_to_load = parser.loras_to_load
-                    if not loras_to_load:
-                        self.last_lora_config, self.cached_model, self.cached_clip = (
-                            None,
-                            None,
-                            None,
-                        )
-                        model_out, clip_out = model, clip
-                    else:
-                        current_lora_config = tuple(sorted(loras_to_load))
-                        # Use instance caching for the *result* (patched model), which is safe
-                        if (
-                            self.cached_model is not None
-                            and self.last_input_model_id == id(model)
-                            and self.last_lora_config == current_lora_config
-                        ):
-                            model_out, clip_out = self.cached_model, self.cached_clip
-                        else:
-                            model_out, clip_out = self.apply_loras(
-                                model, clip, loras_to_load
-                            )
-                            self.cached_model, self.cached_clip = model_out, clip_out
-                            self.last_lora_config, self.last_input_model_id = (
-                                current_lora_config,
-                                id(model),
-                            )
+                    model_out, clip_out = self.apply_loras(
+                        model, clip, parser.loras_to_load
+                    )
 
             if clip_out is not None:
                 current_area_config = None
                 if hasattr(parser, "areas_to_apply") and parser.areas_to_apply:
-                    config_list = []
-                    for title in sorted(parser.areas_to_apply):
-                        if title in area_boxes:
-                            area_box = area_boxes[title]
-                            area_prompt, _ = parser.parse(area_box.get("content", ""))
-                            if area_prompt:
-                                config_list.append(
-                                    (
-                                        area_prompt,
-                                        area_box.get("imageWidth", 512),
-                                        area_box.get("imageHeight", 512),
-                                        area_box.get("areaX", 0),
-                                        area_box.get("areaY", 0),
-                                        area_box.get("areaWidth", 64),
-                                        area_box.get("areaHeight", 64),
-                                        area_box.get("strength", 1.0),
-                                    )
-                                )
-                    current_area_config = tuple(config_list)
+                    current_area_config = self._area_config(parser, area_boxes)
 
                 current_timed_config = None
                 if hasattr(parser, "scheduled_prompts") and parser.scheduled_prompts:
@@ -237,88 +278,75 @@ class ThoughtBubbleNode:
                         )
                     )
 
-                if (
-                    self.cached_positive_cond is not None
-                    and self.last_clip_id == id(clip_out)
-                    and self.last_positive_prompt == positive_prompt
-                    and self.last_negative_prompt == negative_prompt
-                    and self.last_area_config == current_area_config
-                    and self.last_timed_config == current_timed_config
-                ):
-
-                    positive_conditioning = self.cached_positive_cond
-                    negative_conditioning = self.cached_negative_cond
-                else:
-                    positive_conditioning = self.text_to_conditioning(
-                        clip_out, positive_prompt
-                    )
-                    negative_conditioning = self.text_to_conditioning(
-                        clip_out, negative_prompt
+                # Each prompt is cached on its own; misses are encoded together.
+                self._load_disk_cache()
+                texts = [positive_prompt, negative_prompt]
+                if current_area_config:
+                    texts.extend(
+                        area[0]
+                        for area in current_area_config
+                        if area[5] > 0 and area[6] > 0
                     )
+                if current_timed_config:
+                    texts.extend(timed[0] for timed in current_timed_config)
+                encoded = get_conditioning(clip_out, texts)
 
-                    if current_area_config:
-                        for area_config in current_area_config:
-                            (area_prompt, img_w, img_h, x, y, w, h, strength) = (
-                                area_config
-                            )
-                            if w <= 0 or h <= 0:
-                                continue
+                positive_conditioning = list(encoded.get(positive_prompt, []))
+                negative_conditioning = list(encoded.get(negative_prompt, []))
 
-                            mask = torch.zeros(
-                                (img_h // 8, img_w // 8),
-                                dtype=torch.float32,
-                                device="cpu",
-                            )
-                            mask[y // 8 : (y + h) // 8, x // 8 : (x + w) // 8] = 1.0
+                if current_area_config:
+                    for area_config in current_area_config:
+                        (area_prompt, img_w, img_h, x, y, w, h, strength) = (
+                            area_config
+                        )
+                        if w <= 0 or h <= 0:
+                            continue
 
-                            area_cond_data = self.text_to_conditioning(
-                                clip_out, area_prompt
-                            )
-                            if not area_cond_data:
-                                continue
+                        mask = torch.zeros(
+                            (img_h // 8, img_w // 8),
+                            dtype=torch.float32,
+                            device="cpu",
+                        )
+                        mask[y // 8 : (y + h) // 8, x // 8 : (x + w) // 8] = 1.0
 
-                            cond_tensor, cond_dict = (
-                                area_cond_data[0][0],
-                                area_cond_data[0][1].copy(),
-                            )
-                            cond_dict["mask"], cond_dict["mask_strength"] = (
-                                mask,
-                                strength,
-                            )
-                            positive_conditioning.append([cond_tensor, cond_dict])
+                        area_cond_data = encoded.get(area_prompt)
+                        if not area_cond_data:
+                            continue
 
-                    if current_timed_config:
-                        for timed_config in current_timed_config:
-                            (timed_prompt, start_at, end_at) = timed_config
+                        cond_tensor, cond_dict = (
+                            area_cond_data[0][0],
+                            area_cond_data[0][1].copy(),
+                        )
+                        cond_dict["mask"], cond_dict["mask_strength"] = (
+                            mask,
+                            strength,
+                        )
+                        positive_conditioning.append([cond_tensor, cond_dict])
 
-                            timed_cond_data = self.text_to_conditioning(
-                                clip_out, timed_prompt
-                            )
-                            if not timed_cond_data:
-                                continue
+                if current_timed_config:
+                    for timed_config in current_timed_config:
+                        (timed_prompt, start_at, end_at) = timed_config
 
-                            cond_tensor, cond_dict = (
-                                timed_cond_data[0][0],
-                                timed_cond_data[0][1].copy(),
-                            )
+                        timed_cond_data = encoded.get(timed_prompt)
+                        if not timed_cond_data:
+                            continue
 
-                            cond_dict["start_at"] = float(start_at)
-                            cond_dict["end_at"] = float(end_at)
+                        cond_tensor, cond_dict = (
+                            timed_cond_data[0][0],
+                            timed_cond_data[0][1].copy(),
+                        )
 
-                            positive_conditioning.append([cond_tensor, cond_dict])
+                        cond_dict["start_at"] = float(start_at)
+                        cond_dict["end_at"] = float(end_at)
 
-                    self.cached_positive_cond = positive_conditioning
-                    self.cached_negative_cond = negative_conditioning
-                    self.last_positive_prompt = positive_prompt
-                    self.last_negative_prompt = negative_prompt
-                    self.last_clip_id = id(clip_out)
-                    self.last_area_config = current_area_config
-                    self.last_timed_config = current_timed_config
+                        positive_conditioning.append([cond_tensor, cond_dict])
 
         except json.JSONDecodeError:
             print(f"Thought Bubble Error: Could not decode JSON data from canvas.")
         except Exception as e:
             print(f"Thought Bubble Error: {e}")
+        finally:
+            self._close_wildcards()
 
         return (
             model_out,
@@ -332,63 +360,148 @@ class ThoughtBubbleNode:
     def text_to_conditioning(self, clip, text):
         if not text:
             return []
+        return get_conditioning(clip, [text])[text]
 
-        if hasattr(clip, "clip_l") and hasattr(clip, "clip_g"):
-            tokens_l = clip.clip_l.tokenize(text)
-            tokens_g = clip.clip_g.tokenize(text)
+    @staticmethod
+    def _resolve_lora(lora_name):
+        lora_filename = get_name_index("loras").find_prefix(lora_name)
+        if lora_filename:
+            return folder_paths.get_full_path("loras", lora_filename)
+        return None
 
-            max_len = max(len(tokens_l["l"]), len(tokens_g["g"]))
+    def _prefetch_lora(self, lora_name):
+        try:
+            lora_path = self._resolve_lora(lora_name)
+            if lora_path:
+                prefetch_lora(lora_path)
+        except Exception as e:
+            print(f"Thought Bubble Warning: Could not prefetch LoRA '{lora_name}': {e}")
 
-            if len(tokens_l["l"]) < max_len:
-                tokens_l["l"] = tokens_l["l"] + [tokens_l["l"][-1]] * (
-                    max_len - len(tokens_l["l"])
-                )
+    def apply_loras(self, model, clip, loras_to_load):
+        if not loras_to_load:
+            return model, clip
 
-            if len(tokens_g["g"]) < max_len:
-                tokens_g["g"] = tokens_g["g"] + [tokens_g["g"][-1]] * (
-                    max_len - len(tokens_g["g"])
+        resolved = []
+        for lora_name, model_strength, clip_strength in loras_to_load:
+            lora_path = self._resolve_lora(lora_name)
+            if lora_path:
+                resolved.append((lora_path, model_strength, clip_strength))
+            else:
+                print(
+                    f"Thought Bubble Warning: Could not find a file for LoRA '{lora_name}'"
                 )
 
-            cond_l, _ = clip.clip_l.encode_from_tokens(tokens_l, return_pooled=False)
-            cond_g, pooled_g = clip.clip_g.encode_from_tokens(
-                tokens_g, return_pooled=True
-            )
+        return self.lora_stack.apply(model, clip, resolved)
 
-            cond = torch.cat((cond_l, cond_g), dim=-1)
-            return [[cond.clone(), {"pooled_output": pooled_g.clone()}]]
-        else:
-            tokens = clip.tokenize(text)
-            cond, pooled = clip.encode_from_tokens(tokens, return_pooled=True)
-            return [[cond.clone(), {"pooled_output": pooled.clone()}]]
 
-    def apply_loras(self, model, clip, loras_to_load):
-        model_out, clip_out = model.clone(), clip.clone()
-        available_loras = folder_paths.get_filename_list("loras")
+class ThoughtBubbleBatchNode(ThoughtBubbleNode):
+    """
+    Evaluates one canvas for many (seed, iterator) pairs in a single run.
 
-        for lora_name, model_strength, clip_strength in loras_to_load:
-            lora_filename = next(
-                (l for l in available_loras if l.startswith(lora_name)), None
-            )
-            if lora_filename:
-                try:
-                    lora_path = folder_paths.get_full_path("loras", lora_filename)
+    Pair k uses seed + k * seed_step and the canvas iterator + k * iterator_step.
+    The canvas JSON is read once and every pair runs against the same parsed
+    tree, so each output equals what ThoughtBubbleNode would produce for that
+    seed and iterator. Outputs are lists with one entry per pair.
+    """
+
+    @classmethod
+    def INPUT_TYPES(s):
+        inputs = super().INPUT_TYPES()
+        canvas_input = inputs["required"]["canvas_data"]
+        return {
+            "required": {
+                "seed": ("INT", {"default": 0, "min": 0, "max": 0xFFFFFFFFFFFFFFFF}),
+                "batch_size": ("INT", {"default": 4, "min": 1, "max": 4096}),
+                "seed_step": ("INT", {"default": 1, "min": 0, "max": 0xFFFF}),
+                "iterator_step": ("INT", {"default": 1, "min": 0, "max": 0xFFFF}),
+                "canvas_data": canvas_input,
+            },
+        }
 
-                    # --- FIX: Load LoRA directly without permanent caching ---
-                    # Python's GC will free 'lora' once this function finishes and
-                    # the model patcher has extracted what it needs.
-                    lora = comfy.utils.load_torch_file(lora_path, safe_load=True)
+    RETURN_TYPES = ("STRING", "STRING", "INT", "INT", "STRING")
+    RETURN_NAMES = (
+        "positive_prompt_text",
+        "negative_prompt_text",
+        "seed",
+        "iterator",
+        "details",
+    )
+    OUTPUT_IS_LIST = (True, True, True, True, True)
+    FUNCTION = "process_batch"
 
-                    model_out, clip_out = comfy.sd.load_lora_for_models(
-                        model_out, clip_out, lora, model_strength, clip_strength
-                    )
+    def process_batch(self, seed, batch_size, seed_step, iterator_step, canvas_data):
+        positives, negatives, seeds, iterators, details = [], [], [], [], []
 
-                except Exception as e:
-                    print(
-                        f"Thought Bubble Warning: Could not apply LoRA '{lora_filename}': {e}"
+        try:
+            canvas = self._read_canvas(canvas_data)
+            pairs = [
+                (
+                    (seed + k * seed_step) % 0x10000000000000000,
+                    canvas["iterator"] + k * iterator_step,
+                )
+                for k in range(batch_size)
+            ]
+            if canvas["source"]:
+                parser = self._create_parser(canvas, seed)
+                for result in parser.iter_batch(canvas["source"], pairs):
+                    # Side outputs are read before the area boxes are parsed,
+                    # since parse() resets them.
+                    areas = []
+                    if result["areas"]:
+                        for area in self._area_config(parser, canvas["area_boxes"]):
+                            prompt, img_w, img_h, x, y, w, h, strength = area
+                            areas.append(
+                                {
+                                    "prompt": prompt,
+                                    "image_width": img_w,
+                                    "image_height": img_h,
+                                    "x": x,
+                                    "y": y,
+                                    "width": w,
+                                    "height": h,
+                                    "strength": strength,
+                                }
+                            )
+                    positives.append(result["positive"])
+                    negatives.append(result["negative"])
+                    seeds.append(result["seed"])
+                    iterators.append(result["iterator"])
+                    details.append(
+                        json.dumps(
+                            {
+                                "loras": [
+                                    {
+                                        "name": name,
+                                        "model_strength": model_strength,
+                                        "clip_strength": clip_strength,
+                                    }
+                                    for name, model_strength, clip_strength in result[
+                                        "loras"
+                                    ]
+                                ],
+                                "areas": areas,
+                                "scheduled_prompts": sorted(
+                                    result["scheduled_prompts"],
+                                    key=lambda x: x["start_at"],
+                                ),
+                            }
+                        )
                     )
             else:
-                print(
-                    f"Thought Bubble Warning: Could not find a file for LoRA '{lora_name}'"
-                )
+                for batch_seed, batch_iterator in pairs:
+                    positives.append("")
+                    negatives.append("")
+                    seeds.append(batch_seed)
+                    iterators.append(batch_iterator)
+                    details.append(
+                        json.dumps({"loras": [], "areas": [], "scheduled_prompts": []})
+                    )
+
+        except json.JSONDecodeError:
+            print(f"Thought Bubble Error: Could not decode JSON data from canvas.")
+        except Exception as e:
+            print(f"Thought Bubble Error: {e}")
+        finally:
+            self._close_wildcards()
 
-        return model_out, clip_out
+        return (positives, negatives, seeds, iterators, details)
@@ -0,0 +1,271 @@
+# filename: thoughtbubble/wildcards.py
+
+import mmap
+import os
+import re
+import struct
+import threading
+from array import array
+from collections.abc import Sequence
+
+# Index file layout: header, then one native uint64 per line start followed by
+# the end offset of the last line.
+_INDEX_MAGIC = b"TBWIDX01"
+_INDEX_HEADER = struct.Struct("<8sQQQ")  # magic, mtime_ns, size, line count
+_NEWLINE = re.compile(rb"\r\n|\r|\n")
+# Files smaller than this are read into memory instead of mapped, so they
+# hold no mapping (and no lock on Windows) at all.
+_MAP_MIN_BYTES = 16 * 1024 * 1024
+
+
+def _read(path):
+    """Contents of `path`: bytes for small files, a read-only mmap otherwise."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < _MAP_MIN_BYTES:
+            return f.read()
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class WildcardFile(Sequence):
+    """
+    Read-only, sequence-like view of one wildcard file.
+
+    Lines are the same as `[line.strip() for line in open(path)]` but they are
+    decoded on demand: line N is located through a line-offset index that is
+    persisted next to the other ThoughtBubble caches and only rebuilt when the
+    file's mtime or size changes. Large files and their indexes are
+    memory-mapped; the store closes them after every execution.
+    """
+
+    def __init__(self, path, index_path):
+        self.path = path
+        self.index_path = index_path
+        self.version = None
+        self._data = None
+        self._index = None
+        self._offsets = None
+        self._count = 0
+        self._open()
+
+    def _open(self):
+        stat = os.stat(self.path)
+        self.version = (stat.st_mtime_ns, stat.st_size)
+        if stat.st_size == 0:
+            self._count = 0
+            return
+        self._data = _read(self.path)
+        if not self._load_index():
+            offsets = self._build_index()
+            if not self._load_index():
+                # Index directory not writable: keep the offsets in memory.
+                self._offsets = memoryview(offsets)
+                self._count = len(offsets) - 1
+
+    def _load_index(self):
+        try:
+            index = _read(self.index_path)
+        except (OSError, ValueError):
+            return False
+        if len(index) >= _INDEX_HEADER.size:
+            magic, mtime_ns, size, count = _INDEX_HEADER.unpack_from(index)
+            expected = _INDEX_HEADER.size + (count + 1) * 8
+            if (
+                magic == _INDEX_MAGIC
+                and (mtime_ns, size) == self.version
+                and len(index) == expected
+            ):
+                self._index = index
+                self._offsets = memoryview(index)[_INDEX_HEADER.size :].cast("Q")
+                self._count = count
+                return True
+        if isinstance(index, mmap.mmap):
+            index.close()
+        return False
+
+    def _build_index(self):
+        data = self._data
+        size = len(data)
+        offsets = array("Q", [0])
+        for match in _NEWLINE.finditer(data):
+            offsets.append(match.end())
+        if offsets[-1] == size:
+            # A trailing newline does not start another line.
+            offsets.pop()
+        count = len(offsets)
+        offsets.append(size)
+
+        temp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            with open(temp_path, "wb") as f:
+                f.write(_INDEX_HEADER.pack(_INDEX_MAGIC, *self.version, count))
+                offsets.tofile(f)
+            os.replace(temp_path, self.index_path)
+        except OSError as e:
+            print(f"Thought Bubble Warning: Could not write wildcard index: {e}")
+        return offsets
+
+    def is_current(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        return (stat.st_mtime_ns, stat.st_size) == self.version
+
+    @property
+    def is_mapped(self):
+        return isinstance(self._data, mmap.mmap) or isinstance(self._index, mmap.mmap)
+
+    def close(self):
+        if self._offsets is not None:
+            self._offsets.release()
+            self._offsets = None
+        for mapping in (self._index, self._data):
+            if isinstance(mapping, mmap.mmap):
+                mapping.close()
+        self._index = self._data = None
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("wildcard line index out of range")
+        start, end = self._offsets[index], self._offsets[index + 1]
+        return self._data[start:end].decode("utf-8", errors="replace").strip()
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self[i]
+
+
+class WildcardStore:
+    """
+    Lazily opened mapping of wildcard name -> WildcardFile.
+
+    Only the directory listing is read up front. Files are opened on first use
+    and revalidated at most once per refresh() (one refresh per execution).
+    Files read into memory are kept between executions; close_mapped_files()
+    drops the mapped ones once an execution is done, so no wildcard stays
+    mapped while the user edits it.
+    """
+
+    def __init__(self, directory, index_directory):
+        self.directory = directory
+        self.index_directory = index_directory
+        self._filenames = {}
+        self._files = {}
+        self._checked = set()
+        self._directory_mtime = None
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        with self._lock:
+            self._checked.clear()
+            try:
+                mtime = os.stat(self.directory).st_mtime_ns
+            except OSError:
+                self._filenames = {}
+                return
+            if mtime == self._directory_mtime:
+                return
+            filenames = {}
+            for filename in sorted(os.listdir(self.directory)):
+                if filename.endswith(".txt"):
+                    filenames[os.path.splitext(filename)[0].lower()] = filename
+            self._filenames = filenames
+            self._directory_mtime = mtime
+            for name in [n for n in self._files if n not in filenames]:
+                self._files.pop(name).close()
+
+    def close_mapped_files(self):
+        """Closes the mapped files; each is reopened from its saved index on use."""
+        with self._lock:
+            for name in [n for n, w in self._files.items() if w.is_mapped]:
+                self._files.pop(name).close()
+                self._checked.discard(name)
+
+    def release(self, filename):
+        """Unmaps a file so it can be rewritten (required on Windows)."""
+        name = os.path.splitext(os.path.basename(filename))[0].lower()
+        with self._lock:
+            wildcard = self._files.pop(name, None)
+            if wildcard is not None:
+                wildcard.close()
+            self._directory_mtime = None
+
+    def __contains__(self, name):
+        return name in self._filenames
+
+    def __iter__(self):
+        return iter(self._filenames)
+
+    def __len__(self):
+        return len(self._filenames)
+
+    def keys(self):
+        return self._filenames.keys()
+
+    def file_version(self, name):
+        """(mtime_ns, size) of a wildcard's file, without mapping it; None if missing."""
+        filename = self._filenames.get(name)
+        if filename is None:
+            return None
+        try:
+            stat = os.stat(os.path.join(self.directory, filename))
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+        except OSError as e:
+            print(f"Thought Bubble Error loading wildcard '{name}': {e}")
+            return default
+
+    def __getitem__(self, name):
+        filename = self._filenames[name]
+        with self._lock:
+            wildcard = self._files.get(name)
+            if wildcard is not None and name not in self._checked:
+                if not wildcard.is_current():
+                    wildcard.close()
+                    wildcard = None
+                self._checked.add(name)
+            if wildcard is None:
+                wildcard = WildcardFile(
+                    os.path.join(self.directory, filename),
+                    os.path.join(self.index_directory, f"{filename}.idx"),
+                )
+                self._files[name] = wildcard
+                self._checked.add(name)
+            return wildcard
+
+
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+def get_wildcard_store(directory, index_directory):
+    """Returns the process-wide store for a wildcard directory."""
+    with _STORES_LOCK:
+        store = _STORES.get(directory)
+        if store is None:
+            store = WildcardStore(directory, index_directory)
+            _STORES[directory] = store
+        return store
+
+
+def release_wildcard(directory, filename):
+    store = _STORES.get(directory)
+    if store is not None:
+        store.release(filename)